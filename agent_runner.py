@@ -1,4 +1,4 @@
-from health_bot import HealthBotSession, UserInputRequest
+from health_bot import HealthBotSession, TokenDelta, UserInputRequest
 
 
 class HealthBotRunner:
@@ -7,7 +7,7 @@ class HealthBotRunner:
 
     def start_conversation(self, initial_question: str):
         """Start a new conversation with the given question"""
-        self.session = HealthBotSession(initial_question)
+        self.session = HealthBotSession(initial_question, stream_tokens=True)
         self.run_conversation()
 
     def run_conversation(self):
@@ -18,15 +18,23 @@ class HealthBotRunner:
         # Start the conversation generator
         conversation = self.session.run_conversation()
         response = None
+        streaming = False
 
         try:
             # Get the first response
             response = next(conversation)
 
             while True:
-                if isinstance(response, str):
-                    # AI message - display it
-                    print(response)
+                if isinstance(response, TokenDelta):
+                    # Partial AI message - display tokens as they arrive
+                    print(response.content, end="", flush=True)
+                    streaming = True
+                    response = next(conversation)
+
+                elif isinstance(response, str):
+                    # AI message - display it, unless it was streamed already
+                    print("" if streaming else response)
+                    streaming = False
                     # Get next response
                     response = next(conversation)
 
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from cache import CacheStats
+
+# Words that carry no topic information; dropping them keeps rewordings
+# of the same question close
+STOP_WORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "can", "could", "do",
+    "does", "for", "from", "how", "i", "if", "in", "is", "it", "me", "my",
+    "of", "on", "or", "should", "tell", "that", "the", "there", "to", "what",
+    "when", "which", "who", "why", "will", "with", "would", "you", "your",
+}
+
+NEGATIONS = {
+    "not", "no", "never", "without", "nor", "cannot", "cant", "dont",
+    "doesnt", "isnt", "arent", "wont", "shouldnt",
+}
+
+# Opposite ends of the same question; two questions at opposite ends are
+# never treated as the same, however similar their embeddings are
+POLARITIES = (
+    ({"good", "safe", "healthy", "benefit", "benefits", "beneficial",
+      "help", "helps", "helpful", "improve", "improves", "better", "best"},
+     {"bad", "unsafe", "dangerous", "harmful", "harm", "harms", "hurt",
+      "hurts", "unhealthy", "damage", "damages", "worse", "worst"}),
+    ({"increase", "increases", "raise", "raises", "high", "higher", "more",
+      "gain", "gaining"},
+     {"decrease", "decreases", "lower", "lowers", "low", "reduce",
+      "reduces", "less", "lose", "losing"}),
+)
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.lower().replace("'", "")))
+
+
+def contradicts(question: str, other: str) -> bool:
+    """True if one question is negated and the other is not, or they ask
+    about opposite ends of a polarity (good/bad, raise/lower, ...)"""
+    words, other_words = _words(question), _words(other)
+    if bool(words & NEGATIONS) != bool(other_words & NEGATIONS):
+        return True
+    for positive, negative in POLARITIES:
+        sides = [(bool(w & positive), bool(w & negative))
+                 for w in (words, other_words)]
+        if {sides[0], sides[1]} == {(True, False), (False, True)}:
+            return True
+    return False
+
+
+class HashingEmbedder:
+    """Offline question embedding: hashed word and character-trigram
+    features, L2-normalised. Stable across processes and restarts.
+
+    Word overlap is all it measures, so it only recognises near-identical
+    questions (reordered, punctuation, small typos); real paraphrases need
+    SentenceTransformerEmbedder."""
+
+    default_threshold = 0.95
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _features(self, text: str):
+        words = [w for w in re.findall(r"\w+", text.lower())
+                 if w not in STOP_WORDS]
+        for word in words:
+            yield "w:" + word, 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3], 0.5
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign * weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceTransformerEmbedder:
+    """Embedding with a small local sentence-transformers model"""
+
+    default_threshold = 0.8
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.model.encode(text, normalize_embeddings=True).astype(
+            np.float32)
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    summary: str
+    score: float
+
+
+class AnswerCache:
+    """Semantic cache of summaries, looked up by cosine similarity of the
+    question embedding. All stored embeddings live in one preallocated
+    matrix, so a lookup is a single matrix-vector product. When full, the
+    least recently used entry is evicted. The threshold defaults to the
+    embedder's; matches that contradict the question are skipped."""
+
+    def __init__(self, max_entries: int, threshold: Optional[float] = None,
+                 ttl: float = 24 * 60 * 60, embedder=None):
+        self.max_entries = max_entries
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold if threshold is not None \
+            else self.embedder.default_threshold
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.contradictions = 0
+        self._vectors = np.zeros((max_entries, self.embedder.dim),
+                                 dtype=np.float32)
+        self._questions = [None] * max_entries
+        self._summaries = [None] * max_entries
+        self._expires_at = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _scores(self, vector: np.ndarray) -> np.ndarray:
+        # Empty and expired slots have expires_at in the past
+        scores = self._vectors @ vector
+        scores[self._expires_at < time.time()] = -1.0
+        return scores
+
+    def _best_match(self, vector: np.ndarray):
+        scores = self._scores(vector)
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+    def lookup(self, question: str) -> Optional[CachedAnswer]:
+        """Return the cached answer for the most similar question, if it is
+        above the similarity threshold"""
+        if not self.enabled:
+            return None
+        vector = self.embedder.embed(question)
+        with self._lock:
+            scores = self._scores(vector)
+            for slot in np.argsort(-scores):
+                score = float(scores[slot])
+                if score < self.threshold:
+                    break
+                if contradicts(question, self._questions[slot]):
+                    self.contradictions += 1
+                    continue
+                self._last_used[slot] = time.time()
+                self.stats.hits += 1
+                return CachedAnswer(self._questions[slot],
+                                    self._summaries[slot], score)
+            self.stats.misses += 1
+            return None
+
+    def add(self, question: str, summary: str):
+        if not self.enabled:
+            return
+        vector = self.embedder.embed(question)
+        now = time.time()
+        with self._lock:
+            slot, score = self._best_match(vector)
+            if score < 0.99:
+                # Not a near-identical question: reuse an empty or expired
+                # slot, otherwise evict the least recently used entry
+                expired = self._expires_at < now
+                if expired.any():
+                    slot = int(np.argmax(expired))
+                    if self._questions[slot] is not None:
+                        self.stats.expirations += 1
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self.stats.evictions += 1
+            self._vectors[slot] = vector
+            self._questions[slot] = question
+            self._summaries[slot] = summary
+            self._expires_at[slot] = now + self.ttl
+            self._last_used[slot] = now
+
+    def report(self) -> dict:
+        report = self.stats.as_dict()
+        report["entries"] = int((self._expires_at >= time.time()).sum())
+        report["contradictions"] = self.contradictions
+        return report
+
+    @classmethod
+    def from_env(cls) -> "AnswerCache":
+        """Build the cache from ANSWER_CACHE_SIZE (entries, 0 disables),
+        ANSWER_CACHE_MODEL (sentence-transformers model name; without it
+        the hashing embedder only matches near-identical questions),
+        ANSWER_CACHE_THRESHOLD (cosine similarity, default 0.8 with a model
+        and 0.95 without) and ANSWER_CACHE_TTL (seconds)"""
+        model_name = os.getenv("ANSWER_CACHE_MODEL")
+        threshold = os.getenv("ANSWER_CACHE_THRESHOLD")
+        return cls(
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", 0)),
+            threshold=float(threshold) if threshold else None,
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", 24 * 60 * 60)),
+            embedder=SentenceTransformerEmbedder(model_name)
+            if model_name else None,
+        )
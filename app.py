@@ -1,7 +1,14 @@
 import streamlit as st
+import os
+import time
 import uuid
-from typing import Generator
-from health_bot import HealthBotSession, UserInputRequest
+from concurrent.futures import ThreadPoolExecutor
+import health_bot
+from health_bot import HealthBotSession
+from session_worker import SessionWorker
+
+# How often the UI checks on a step running in the background (seconds)
+POLL_SECONDS = float(os.getenv("UI_POLL_SECONDS", 0.3))
 
 # Page configuration
 st.set_page_config(
@@ -11,6 +18,24 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+@st.cache_resource
+def shared_graph():
+    """LLM client and compiled graph, built once per server process and
+    shared by every browser session"""
+    health_bot.get_llm()
+    return health_bot.get_graph()
+
+
+@st.cache_resource
+def step_executor():
+    """Threads that run conversation steps off the script thread"""
+    return ThreadPoolExecutor(max_workers=int(os.getenv("UI_WORKERS", 8)),
+                              thread_name_prefix="conversation")
+
+
+shared_graph()
+
 # Custom CSS for better styling
 st.markdown("""
 <style>
@@ -77,8 +102,11 @@ with st.sidebar:
         st.session_state.messages = []
     if "bot_session" not in st.session_state:
         st.session_state.bot_session = None
-    if "conversation_generator" not in st.session_state:
-        st.session_state.conversation_generator = None
+    if "worker" not in st.session_state:
+        st.session_state.worker = None
+    if "step_start" not in st.session_state:
+        # Index of the first message of the step running in the background
+        st.session_state.step_start = None
     if "awaiting_input" not in st.session_state:
         st.session_state.awaiting_input = None
     if "conversation_active" not in st.session_state:
@@ -105,7 +133,8 @@ with st.sidebar:
     if st.button("🗑️ Clear Conversation", use_container_width=True):
         st.session_state.messages = []
         st.session_state.bot_session = None
-        st.session_state.conversation_generator = None
+        st.session_state.worker = None
+        st.session_state.step_start = None
         st.session_state.awaiting_input = None
         st.session_state.conversation_active = False
         st.session_state.session_id = str(uuid.uuid4())[:8]
@@ -140,64 +169,71 @@ with st.sidebar:
         - "What foods help boost immunity?"
         """)
 
-def create_conversation_generator(question: str) -> Generator:
-    """Create and start a conversation generator for the given question"""
-    bot_session = HealthBotSession(question)
+def create_conversation_worker(question: str) -> SessionWorker:
+    """Create the background worker for a conversation about question"""
+    bot_session = HealthBotSession(question, stream_tokens=True)
     st.session_state.bot_session = bot_session
-    return bot_session.run_conversation()
+    return SessionWorker(bot_session, step_executor())
 
 def continue_conversation(user_input=None):
-    """Continue the bot conversation, handling both messages and input requests"""
-    try:
-        if user_input is not None:
-            # Send user response to the generator
-            result = st.session_state.conversation_generator.send(user_input)
-        else:
-            # Get next item from generator
-            result = next(st.session_state.conversation_generator)
+    """Start advancing the bot in the background, until it requests user
+    input or the conversation ends. show_progress() renders the step."""
+    st.session_state.step_start = len(st.session_state.messages)
+    st.session_state.awaiting_input = None
+    st.session_state.worker.step(user_input)
 
-        if isinstance(result, UserInputRequest):
-            # Bot is requesting user input
-            st.session_state.awaiting_input = result
-        else:
-            # Bot sent a message - add it to messages
-            st.session_state.messages.append({"role": "assistant", "content": result})
-            st.session_state.awaiting_input = None
-            
-            # Continue processing to get any immediate follow-up messages
-            try:
-                next_result = next(st.session_state.conversation_generator)
-                if isinstance(next_result, UserInputRequest):
-                    st.session_state.awaiting_input = next_result
-                else:
-                    # Another immediate message from bot
-                    st.session_state.messages.append({"role": "assistant", "content": next_result})
-                    # Check for another input request
-                    try:
-                        follow_up = next(st.session_state.conversation_generator)
-                        if isinstance(follow_up, UserInputRequest):
-                            st.session_state.awaiting_input = follow_up
-                    except StopIteration:
-                        st.session_state.conversation_active = False
-            except StopIteration:
-                st.session_state.conversation_active = False
+def render_progress():
+    """Show the messages of the running step, the one being generated token
+    by token, and rerun the whole app once the step is finished"""
+    worker = st.session_state.worker
+    # Checked before polling, so nothing finished after the poll is missed
+    running = worker.busy
+    messages, partial = worker.poll()
+    st.session_state.messages += [{"role": "assistant", "content": message}
+                                  for message in messages]
+    for message in st.session_state.messages[st.session_state.step_start:]:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    if running:
+        with st.chat_message("assistant"):
+            st.markdown(partial + "▌" if partial
+                        else "🔍 Researching your question...")
+        return
 
-    except StopIteration:
-        # Conversation ended
+    # Step finished
+    st.session_state.step_start = None
+    st.session_state.awaiting_input = worker.request
+    if worker.done:
+        if worker.error is not None:
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": f"⚠️ Something went wrong: {worker.error}"})
         st.session_state.conversation_active = False
-        st.session_state.conversation_generator = None
-        st.session_state.awaiting_input = None
+        st.session_state.worker = None
+    st.rerun()
+
+# Reruns only this part of the page while a step runs; older Streamlit
+# versions without fragments rerun the whole script instead (see the end)
+if hasattr(st, "fragment"):
+    show_progress = st.fragment(run_every=POLL_SECONDS)(render_progress)
+else:
+    show_progress = render_progress
+
+step_running = st.session_state.step_start is not None
 
 # Main chat interface
 chat_container = st.container()
 
 with chat_container:
-    # Display chat history
-    if st.session_state.messages:
-        for message in st.session_state.messages:
+    # Display chat history; messages of a running step are shown by
+    # show_progress()
+    history = st.session_state.messages[:st.session_state.step_start]
+    if history:
+        for message in history:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
-    else:
+    elif not step_running:
         # Welcome message for new users
         with st.chat_message("assistant"):
             st.markdown("""
@@ -213,28 +249,24 @@ with chat_container:
             **What health topic would you like to explore today?**
             """)
 
+    if step_running:
+        show_progress()
+
 # Handle new user input
 if prompt := st.chat_input(
     "Ask a health question...", 
-    disabled=st.session_state.awaiting_input is not None
+    disabled=st.session_state.awaiting_input is not None or step_running
 ):
     # Add user message to chat
     st.session_state.messages.append({"role": "user", "content": prompt})
     
-    # Display user message immediately
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
     # Start new conversation or continue existing one
     if not st.session_state.conversation_active:
-        st.session_state.conversation_generator = create_conversation_generator(prompt)
+        st.session_state.worker = create_conversation_worker(prompt)
         st.session_state.conversation_active = True
-    
-    # Show loading spinner
-    with st.chat_message("assistant"):
-        with st.spinner("🔍 Researching your question..."):
-            continue_conversation()
-    
+
+    # The research runs in the background; the rerun shows its progress
+    continue_conversation()
     st.rerun()
 
 # Handle pending input requests
@@ -296,8 +328,7 @@ if st.session_state.awaiting_input:
                 # Add user's response to message history
                 st.session_state.messages.append({"role": "user", "content": answer.strip()})
                 
-                with st.spinner("Processing your response..."):
-                    continue_conversation(answer.strip())
+                continue_conversation(answer.strip())
                 st.rerun()
 
 # Footer
@@ -308,4 +339,9 @@ st.markdown(
     "Always consult with qualified healthcare professionals for medical advice."
     "</p>",
     unsafe_allow_html=True
-)
\ No newline at end of file
+)
+
+# Without fragments, poll by rerunning the script while a step runs
+if step_running and not hasattr(st, "fragment"):
+    time.sleep(POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1,168 @@
+"""Headless batch mode: runs a JSONL file of questions through the health bot
+and writes one JSONL result per question.
+
+    python batch.py questions.jsonl answers.jsonl --concurrency 8 --quiz
+
+Each input line is a JSON object with the question under --field (default
+"question") and optionally an "id" and a list of "follow_ups" to ask as new
+topics in the same session. Interrupts are answered by a fixed policy
+instead of a human. Results are appended and flushed as rows finish, so
+re-running the same command after a crash skips rows already done.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from health_bot import HealthBotSession, UserInputRequest
+from scheduler import BATCH, priority
+
+
+@dataclass
+class AnswerPolicy:
+    """How the batch runner answers the bot's questions"""
+    quiz: bool = False
+    quiz_answer: str = "I am not sure."
+
+    def answer(self, request: UserInputRequest, follow_ups: list) -> str:
+        if request.input_type == "quiz_choice":
+            return "yes" if self.quiz else "no"
+        if request.input_type == "quiz_answer":
+            return self.quiz_answer
+        if request.input_type == "new_topic_choice":
+            return "yes" if follow_ups else "no"
+        if request.input_type == "new_question":
+            return follow_ups.pop(0)
+        raise ValueError(f"No policy for {request.input_type}")
+
+
+def row_id(row: dict, line_number: int) -> str:
+    return str(row.get("id") or row.get("request_id") or f"line-{line_number}")
+
+
+def run_row(row: dict, question: str, policy: AnswerPolicy) -> dict:
+    """Run one conversation to the end and return its transcript"""
+    follow_ups = list(row.get("follow_ups", []))
+    transcript = []
+    started = time.perf_counter()
+    conversation = HealthBotSession(question).run_conversation()
+    # Interactive users go first when LLM or search calls have to queue
+    with priority(BATCH):
+        try:
+            response = next(conversation)
+            while True:
+                if isinstance(response, UserInputRequest):
+                    answer = policy.answer(response, follow_ups)
+                    transcript.append({"role": "user",
+                                       "input_type": response.input_type,
+                                       "content": answer})
+                    response = conversation.send(answer)
+                else:
+                    transcript.append({"role": "assistant",
+                                       "content": response})
+                    response = next(conversation)
+        except StopIteration:
+            pass
+    return {"transcript": transcript,
+            "elapsed": round(time.perf_counter() - started, 3)}
+
+
+def finished_ids(path: str, retry_errors: bool) -> set:
+    """Ids of rows already in the output file. A line cut short by a crash
+    is ignored, so that row runs again."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if not (retry_errors and result.get("error")):
+                done.add(result["id"])
+    return done
+
+
+def run_batch(input_path: str, output_path: str, field: str = "question",
+              concurrency: int = 4, policy: AnswerPolicy = AnswerPolicy(),
+              retry_errors: bool = False) -> dict:
+    done = finished_ids(output_path, retry_errors)
+    counts = {"skipped": 0, "ok": 0, "error": 0}
+    lock = threading.Lock()
+    # Bounds the rows read ahead of the workers, so input is streamed
+    slots = threading.BoundedSemaphore(concurrency * 2)
+
+    with open(output_path, "a", encoding="utf-8") as output, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+
+        def write(result: dict):
+            with lock:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                counts["error" if "error" in result else "ok"] += 1
+
+        def work(rid: str, row: dict, question: str):
+            try:
+                write({"id": rid, "question": question,
+                       **run_row(row, question, policy)})
+            except Exception as error:
+                write({"id": rid, "question": question,
+                       "error": repr(error)})
+            finally:
+                slots.release()
+
+        with open(input_path, encoding="utf-8") as rows:
+            for line_number, line in enumerate(rows, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    problem = (None if isinstance(row, dict)
+                               else "row is not a JSON object")
+                except ValueError as error:
+                    problem = f"invalid JSON: {error}"
+                if problem:
+                    # One bad line must not abort the rest of the batch
+                    rid = f"line-{line_number}"
+                    if rid in done:
+                        counts["skipped"] += 1
+                    else:
+                        write({"id": rid, "line": line_number,
+                               "error": problem})
+                    continue
+                rid = row_id(row, line_number)
+                if rid in done:
+                    counts["skipped"] += 1
+                    continue
+                if not row.get(field):
+                    write({"id": rid, "error": f"no {field!r} in row"})
+                    continue
+                slots.acquire()
+                pool.submit(work, rid, row, row[field])
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Answer a JSONL file of health questions")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--field", default="question",
+                        help="input key holding the question")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--quiz", action="store_true",
+                        help="accept the quiz offer")
+    parser.add_argument("--quiz-answer", default=AnswerPolicy.quiz_answer)
+    parser.add_argument("--retry-errors", action="store_true",
+                        help="run rows that failed last time again")
+    args = parser.parse_args()
+
+    counts = run_batch(args.input, args.output, args.field, args.concurrency,
+                       AnswerPolicy(args.quiz, args.quiz_answer),
+                       args.retry_errors)
+    print(json.dumps(counts), file=sys.stderr)
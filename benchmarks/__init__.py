@@ -0,0 +1,9 @@
+"""Benchmarks for the health bot. Run the modules with python -m, e.g.
+python -m benchmarks.startup"""
+import math
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile, q in 0..100"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered) / 100) - 1)]
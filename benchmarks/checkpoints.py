@@ -0,0 +1,108 @@
+"""Checkpoint size and serialization time: the default LangGraph serializer
+against CompactSerializer, with and without externalized payloads.
+
+    python -m benchmarks.checkpoints --runs 5
+    python -m benchmarks.checkpoints --history-window 8
+
+Runs the conversation flows of benchmarks.conversation against the fakes,
+then reads every stored checkpoint back. Bytes per checkpoint include the
+channel values, writes and payloads they need.
+"""
+import argparse
+import time
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from benchmarks import fakes
+from benchmarks.conversation import FLOWS, converse, health_bot
+from checkpoint_serde import CompactSerializer, MemoryPayloadStore
+from checkpointing import BoundedMemorySaver
+
+
+class TimedSerializer:
+    """Adds up the time and calls spent in another serializer"""
+
+    def __init__(self, serde):
+        self.serde = serde
+        self.dumps = self.loads = 0
+        self.dumps_seconds = self.loads_seconds = 0.0
+
+    def dumps_typed(self, obj):
+        started = time.perf_counter()
+        try:
+            return self.serde.dumps_typed(obj)
+        finally:
+            self.dumps += 1
+            self.dumps_seconds += time.perf_counter() - started
+
+    def loads_typed(self, data):
+        started = time.perf_counter()
+        try:
+            return self.serde.loads_typed(data)
+        finally:
+            self.loads += 1
+            self.loads_seconds += time.perf_counter() - started
+
+
+def serializers(min_payload: int) -> dict:
+    return {
+        "default": JsonPlusSerializer(),
+        "compressed": CompactSerializer(),
+        "compressed+payloads": CompactSerializer(
+            MemoryPayloadStore(60 * 60), min_payload=min_payload),
+    }
+
+
+def measure(serde, runs: int) -> dict:
+    timed = TimedSerializer(serde)
+    saver = BoundedMemorySaver(serde=timed)
+    health_bot._graph = health_bot.build_graph(saver)
+    for _ in range(runs):
+        for question, answers in FLOWS.values():
+            health_bot.search_cache.clear()
+            converse(question, answers)
+    written, write_seconds = timed.dumps, timed.dumps_seconds
+
+    # Read every checkpoint of every thread back, with its channel values
+    checkpoints = 0
+    for thread_id in list(saver.storage):
+        checkpoints += sum(1 for _ in saver.list(
+            {"configurable": {"thread_id": thread_id}}))
+    payload_bytes = serde.payloads.bytes_held() \
+        if getattr(serde, "payloads", None) is not None else 0
+    return {
+        "checkpoints": checkpoints,
+        "bytes_per_checkpoint":
+            (saver.bytes_held() + payload_bytes) / checkpoints,
+        "dumps_us": write_seconds / written * 1e6,
+        "loads_us": timed.loads_seconds / timed.loads * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-payload", type=int, default=512,
+                        help="externalize strings of at least this many "
+                             "bytes")
+    parser.add_argument("--history-window", type=int, default=0,
+                        help="run with HISTORY_WINDOW, i.e. new topics on "
+                             "the same thread")
+    args = parser.parse_args()
+
+    fakes.install(health_bot, fakes.FakeChatModel(),
+                  fakes.FakeSearchClient())
+    health_bot.history_window = args.history_window
+    # Threads are never evicted during a run, so all checkpoints are kept
+    print(f"{'serializer':>20}  {'checkpoints':>11}  {'bytes/ckpt':>10}  "
+          f"{'dumps us':>9}  {'loads us':>9}")
+    baseline = None
+    for name, serde in serializers(args.min_payload).items():
+        result = measure(serde, args.runs)
+        baseline = baseline or result
+        change = result["bytes_per_checkpoint"] / \
+            baseline["bytes_per_checkpoint"] - 1
+        print(f"{name:>20}  {result['checkpoints']:>11}  "
+              f"{result['bytes_per_checkpoint']:>10.0f}  "
+              f"{result['dumps_us']:>9.1f}  {result['loads_us']:>9.1f}"
+              f"  ({change:+.0%} bytes)")
@@ -0,0 +1,256 @@
+"""Offline benchmark of full conversations through HealthBotSession.
+
+The LLM and the search API are replaced by the deterministic fakes in
+benchmarks.fakes, so results do not depend on the network and cost nothing.
+Each flow is run --runs times and reported as time per node, graph overhead
+(graph time not spent inside nodes), checkpointer time and memory.
+
+    python -m benchmarks.conversation --runs 20 --llm-latency 0.05
+    python -m benchmarks.conversation --save-baseline baseline.json
+    python -m benchmarks.conversation --baseline baseline.json
+
+With --baseline the exit status is 1 if a metric got worse by more than
+--tolerance (a fraction) compared to the stored results.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import health_bot
+from benchmarks import fakes, percentile
+from checkpointing import BoundedMemorySaver
+
+# Each flow is the question and the answers the simulated user gives
+FLOWS = {
+    "single_topic": ("Is coffee bad for the heart?", ["no", "no"]),
+    "quiz": ("How much sleep do adults need?",
+             ["yes", "About seven to nine hours.", "no"]),
+    "new_topics": ("What are the benefits of meditation?",
+                   ["no", "yes", "Is yoga good for back pain?",
+                    "yes", "It strengthens the core.", "no"]),
+}
+
+# Metrics compared against a baseline; all of them are "lower is better"
+COMPARED = ("wall_ms", "graph_overhead_ms", "checkpoint_ms", "peak_kib")
+
+
+class TimedMemorySaver(BoundedMemorySaver):
+    """Checkpointer that adds up the time spent in it"""
+
+    def __init__(self):
+        super().__init__()
+        self.seconds = 0.0
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def get_tuple(self, config):
+        return self._timed(super().get_tuple, config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self._timed(super().put, config, checkpoint, metadata,
+                           new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        return self._timed(super().put_writes, config, writes, task_id,
+                           task_path)
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Times graph runs and the nodes inside them"""
+
+    def __init__(self):
+        self.started = {}  # run_id -> (node or None for a graph run, time)
+        self.node_seconds = defaultdict(float)
+        self.graph_seconds = 0.0
+
+    def on_chain_start(self, serialized, inputs, *, run_id,
+                       parent_run_id=None, tags=None, metadata=None,
+                       **kwargs):
+        if parent_run_id is None:
+            self.started[run_id] = (None, time.perf_counter())
+        elif any(tag.startswith("graph:step:") for tag in tags or []):
+            self.started[run_id] = (metadata["langgraph_node"],
+                                    time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if run_id not in self.started:
+            return
+        node, started = self.started.pop(run_id)
+        if node is None:
+            self.graph_seconds += time.perf_counter() - started
+        else:
+            self.node_seconds[node] += time.perf_counter() - started
+
+    on_chain_error = on_chain_end
+
+
+def converse(question: str, answers: list, callbacks: list = ()) -> int:
+    """Run one conversation to the end; returns the number of AI messages"""
+    session = health_bot.HealthBotSession(question)
+    session.config["callbacks"] = session.config.get("callbacks", []) + \
+        list(callbacks)
+    answers = iter(answers)
+    conversation = session.run_conversation()
+    messages = 0
+    try:
+        response = next(conversation)
+        while True:
+            if isinstance(response, health_bot.UserInputRequest):
+                response = conversation.send(next(answers))
+            else:
+                messages += 1
+                response = next(conversation)
+    except StopIteration:
+        return messages
+
+
+def run_flow(question: str, answers: list, runs: int,
+             checkpointer: TimedMemorySaver) -> dict:
+    walls, overheads, checkpoints = [], [], []
+    nodes = defaultdict(list)
+    for _ in range(runs):
+        health_bot.search_cache.clear()
+        timer = NodeTimer()
+        checkpointer.seconds = 0.0
+        started = time.perf_counter()
+        converse(question, answers, [timer])
+        walls.append(time.perf_counter() - started)
+        overheads.append(timer.graph_seconds
+                         - sum(timer.node_seconds.values()))
+        checkpoints.append(checkpointer.seconds)
+        for node, seconds in timer.node_seconds.items():
+            nodes[node].append(seconds)
+
+    # Memory is measured on a separate run, tracemalloc slows everything down
+    health_bot.search_cache.clear()
+    held_before = checkpointer.bytes_held()
+    tracemalloc.start()
+    converse(question, answers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def ms(samples):
+        return round(statistics.median(samples) * 1000, 3)
+
+    return {
+        "runs": runs,
+        "wall_ms": ms(walls),
+        "wall_p95_ms": round(percentile(walls, 95) * 1000, 3),
+        "graph_overhead_ms": ms(overheads),
+        "checkpoint_ms": ms(checkpoints),
+        "peak_kib": round(peak / 1024, 1),
+        "checkpoint_kib": round((checkpointer.bytes_held() - held_before)
+                                / 1024, 1),
+        "nodes_ms": {node: ms(samples) for node, samples in nodes.items()},
+    }
+
+
+def run_suite(runs: int, llm: fakes.FakeChatModel,
+              search: fakes.FakeSearchClient, flows: list = None) -> dict:
+    fakes.install(health_bot, llm, search)
+    checkpointer = TimedMemorySaver()
+    health_bot._graph = health_bot.build_graph(checkpointer)
+    # Warm up imports and lazy setup outside the measurements
+    converse(*FLOWS["single_topic"])
+    return {name: run_flow(*FLOWS[name], runs, checkpointer)
+            for name in flows or FLOWS}
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Descriptions of metrics that got worse than baseline * (1 +
+    tolerance)"""
+    found = []
+    for flow, metrics in baseline.items():
+        if flow not in results:
+            continue
+        for metric in COMPARED:
+            old, new = metrics.get(metric), results[flow].get(metric)
+            if old is None or new is None:
+                continue
+            # Absolute slack keeps near-zero metrics from flapping
+            if new > old * (1 + tolerance) + 0.05:
+                found.append(f"{flow}.{metric}: {old} -> {new}")
+    return found
+
+
+def print_results(results: dict):
+    for flow, metrics in results.items():
+        print(f"{flow} ({metrics['runs']} runs)")
+        print(f"  wall {metrics['wall_ms']:.1f} ms "
+              f"(p95 {metrics['wall_p95_ms']:.1f}), "
+              f"graph overhead {metrics['graph_overhead_ms']:.1f} ms, "
+              f"checkpointer {metrics['checkpoint_ms']:.1f} ms")
+        print(f"  peak memory {metrics['peak_kib']:.0f} KiB, "
+              f"checkpoints {metrics['checkpoint_kib']:.0f} KiB")
+        for node, ms in sorted(metrics["nodes_ms"].items(),
+                               key=lambda item: -item[1]):
+            print(f"  {node:>20}: {ms:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--flow", action="append", choices=list(FLOWS),
+                        help="run only this flow (repeatable)")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="mean fake LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-words", type=int, default=150,
+                        help="words per fake LLM answer")
+    parser.add_argument("--queries", type=int, default=1,
+                        help="searches the fake agent asks for")
+    parser.add_argument("--search-latency", type=float, default=0.0)
+    parser.add_argument("--search-jitter", type=float, default=0.0)
+    parser.add_argument("--search-results", type=int, default=5)
+    parser.add_argument("--direct-search", action="store_true",
+                        help="skip the agent for recognised health "
+                             "questions (DIRECT_SEARCH)")
+    parser.add_argument("--fused", action="store_true",
+                        help="summary, quiz and answer key in one call "
+                             "(FUSED_SUMMARY)")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="fail if results regress against this file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    health_bot.direct_search_enabled |= args.direct_search
+    health_bot.fused_summary |= args.fused
+    results = run_suite(
+        args.runs,
+        fakes.FakeChatModel(latency=args.llm_latency, jitter=args.llm_jitter,
+                            words=args.llm_words, queries=args.queries),
+        fakes.FakeSearchClient(args.search_latency, args.search_jitter,
+                               args.search_results),
+        args.flow)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if found else 0)
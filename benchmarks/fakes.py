@@ -0,0 +1,202 @@
+"""Deterministic in-process stand-ins for ChatOpenAI and the search client.
+
+Both answer from the prompt alone, so a conversation produces the same
+messages on every run. Latency is drawn from a seeded normal distribution,
+so timings are repeatable too.
+
+    from benchmarks import fakes
+    fakes.install(health_bot, llm=fakes.FakeChatModel(latency=0.2))
+"""
+import asyncio
+import json
+import random
+import time
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import (ChatGeneration, ChatGenerationChunk,
+                                    ChatResult)
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from benchmarks.stub_servers import search_response
+
+WORDS = ("Regular exercise improves sleep quality blood pressure and mood "
+         "according to several large studies [1] [2] [3].").split()
+
+
+class Latency:
+    """Seeded normal latency distribution, in seconds"""
+
+    def __init__(self, mean: float = 0.0, jitter: float = 0.0,
+                 seed: int = 0):
+        self.mean = mean
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    def sample(self) -> float:
+        if not self.mean and not self.jitter:
+            return 0.0
+        return max(0.0, self.random.gauss(self.mean, self.jitter))
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that plays every role the health bot gives the LLM.
+
+    The research agent (tools bound, question last) asks for `queries`
+    searches; every other prompt gets a `words`-long answer, cut at
+    max_tokens. Streaming yields one chunk per word. Token usage counts
+    bound tool schemas as prompt tokens, like the OpenAI API does.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    words: int = 150
+    queries: int = 1
+    max_tokens: Optional[int] = None
+    seed: int = 0
+    tools: Optional[list] = None
+    _latency: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, context):
+        self._latency = Latency(self.latency, self.jitter, self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools": list(tools)})
+
+    def with_structured_output(self, schema, *, include_raw=False,
+                               method=None, **kwargs):
+        # Always answers with a tool call, i.e. method="function_calling"
+        return super().with_structured_output(schema,
+                                              include_raw=include_raw)
+
+    def reply(self, messages) -> AIMessage:
+        message = self._reply(messages)
+        if self.max_tokens:
+            message.content = message.content[:self.max_tokens * 4]
+        # Roughly four characters per token, like the real tokenizer
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        if self.tools:
+            prompt_tokens += len(json.dumps(
+                [convert_to_openai_tool(tool) for tool in self.tools])) // 4
+        completion_tokens = (len(message.content) + len(json.dumps(
+            [call["args"] for call in message.tool_calls]))) // 4
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+        return message
+
+    def _reply(self, messages) -> AIMessage:
+        last = messages[-1]
+        schema = convert_to_openai_tool(self.tools[0])["function"] \
+            if self.tools else None
+        if schema and schema["name"] != "web_search":
+            # Structured output: a short text for every field, the first
+            # one (the summary) as long as a normal answer
+            fields = list(schema["parameters"]["properties"])
+            args = {field: " ".join(WORDS[i % len(WORDS)] for i in range(
+                        self.words if n == 0 else 12))
+                    for n, field in enumerate(fields)}
+            return AIMessage(content="", tool_calls=[
+                {"name": schema["name"], "id": "call_0", "args": args}])
+        if self.tools and last.type == "human" and \
+                messages[0].content.startswith("You are a health bot"):
+            return AIMessage(content="", tool_calls=[
+                {"name": "web_search", "id": f"call_{i}",
+                 "args": {"query": last.content if i == 0
+                          else f"{last.content} ({i})"}}
+                for i in range(self.queries)])
+        prompt = messages[0].content
+        if prompt.startswith("Generate a comprehension quiz"):
+            return AIMessage(content="How does regular exercise affect "
+                                     "sleep quality?")
+        if prompt.startswith("You are grading"):
+            return AIMessage(content="Grade: B. " + " ".join(
+                WORDS[i % len(WORDS)] for i in range(self.words // 3)))
+        return AIMessage(content=" ".join(
+            WORDS[i % len(WORDS)] for i in range(self.words)))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._latency.sample())
+        return ChatResult(generations=[
+            ChatGeneration(message=self.reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None,
+                         **kwargs):
+        await asyncio.sleep(self._latency.sample())
+        return ChatResult(generations=[
+            ChatGeneration(message=self.reply(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        delay = self._latency.sample()
+        message = self.reply(messages)
+        if message.tool_calls:
+            time.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="", tool_calls=message.tool_calls,
+                usage_metadata=message.usage_metadata))
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(delay / len(words))
+            last = i == len(words) - 1
+            text = word if last else word + " "
+            # Usage comes with the last chunk, like OpenAI's stream_usage
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=text,
+                usage_metadata=message.usage_metadata if last else None))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+
+class FakeSearchClient:
+    """Drop-in for search_client.SearchClient answering with deterministic
+    Tavily-shaped results"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 results: int = 5, words: int = 120, seed: int = 0):
+        self.latency = Latency(latency, jitter, seed)
+        self.results = results
+        self.words = words
+        self.requests = 0
+
+    def search(self, query: str, **kwargs) -> dict:
+        self.requests += 1
+        time.sleep(self.latency.sample())
+        return search_response(query, self.results, self.words)
+
+    def report(self) -> dict:
+        return {"requests": self.requests, "retries": 0, "coalesced": 0}
+
+
+class FakeAsyncSearchClient(FakeSearchClient):
+    """Drop-in for search_client.AsyncSearchClient"""
+
+    async def search(self, query: str, **kwargs) -> dict:
+        self.requests += 1
+        await asyncio.sleep(self.latency.sample())
+        return search_response(query, self.results, self.words)
+
+
+def install(health_bot, llm: FakeChatModel = None,
+            search: FakeSearchClient = None):
+    """Point health_bot at the fakes instead of OpenAI and Tavily"""
+    llm = llm or FakeChatModel()
+    search = search or FakeSearchClient()
+    async_search = FakeAsyncSearchClient(search.latency.mean,
+                                         search.latency.jitter,
+                                         search.results, search.words)
+    # One fake per node profile, with the profile's output cap
+    health_bot.chat_model = lambda profile: llm.model_copy(
+        update={"max_tokens": profile.max_tokens})
+    health_bot._llms.clear()
+    health_bot._search_client = search
+    health_bot.get_async_search_client = lambda: async_search
+    return llm, search
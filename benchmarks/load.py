@@ -0,0 +1,272 @@
+"""Closed-loop load test: N virtual users, each running whole conversations
+through HealthBotSession.run_conversation() and starting the next one when
+it ends.
+
+    python -m benchmarks.load --users 5,10,20,40 --duration 30
+    python -m benchmarks.load --users 10 --think 2 --quiz-rate 0.8 \\
+        --llm-latency 1.5 --json load.json
+
+By default the LLM and search API are the stand-ins of
+benchmarks.stub_servers, started in this process with the given latency, so
+the test costs nothing and measures the bot rather than the providers.
+--upstream env uses whatever OPENAI_BASE_URL / TAVILY_API_URL and API keys
+are set instead.
+
+Each --users value is one stage of --duration seconds. Per stage the report
+has p50/p95/p99 latency per turn type (the input the user had just given,
+or "question" for the first one), turns and conversations per second, the
+error rate, and the process RSS sampled every --sample-interval seconds.
+Throughput that stops growing while p95 does marks the saturation point;
+RSS that keeps growing across stages points to a leak.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+
+from benchmarks import percentile
+from benchmarks.stub_servers import chat_server, search_server
+
+QUESTIONS = (
+    "What are the early symptoms of diabetes?",
+    "How much sleep do adults need?",
+    "Is coffee bad for the heart?",
+    "What helps against tension headaches?",
+    "How can I lower my blood pressure without medication?",
+    "What are the benefits of meditation?",
+    "Is yoga good for back pain?",
+    "How much protein do I need per day?",
+    "What triggers asthma attacks?",
+    "How does vitamin D affect the immune system?",
+)
+
+
+def rss_mib() -> float:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # Peak rather than current RSS, in KiB on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Behaviour:
+    """How a simulated user answers: think time before every answer, the
+    share of quizzes accepted and of conversations continued with another
+    topic (up to max_topics)"""
+
+    def __init__(self, think: float, think_jitter: float, quiz_rate: float,
+                 new_topic_rate: float, max_topics: int):
+        self.think = think
+        self.think_jitter = think_jitter
+        self.quiz_rate = quiz_rate
+        self.new_topic_rate = new_topic_rate
+        self.max_topics = max_topics
+
+    def think_time(self, rng: random.Random) -> float:
+        return max(0.0, rng.gauss(self.think, self.think_jitter))
+
+
+class Stats:
+    """Turn latencies, conversations and errors of one stage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = defaultdict(list)  # turn type -> seconds
+        self.conversations = 0
+        self.completed = 0
+        self.errors = Counter()  # exception type -> count
+        self.rss = []  # (seconds into the stage, MiB)
+
+    def turn(self, kind: str, seconds: float):
+        with self.lock:
+            self.turns[kind].append(seconds)
+
+
+def virtual_user(health_bot, number: int, behaviour: Behaviour,
+                 deadline: float, stats: Stats, seed: int):
+    rng = random.Random(seed * 1000 + number)
+    while time.monotonic() < deadline:
+        with stats.lock:
+            stats.conversations += 1
+        try:
+            if converse(health_bot, rng, behaviour, deadline, stats):
+                with stats.lock:
+                    stats.completed += 1
+        except Exception as error:
+            with stats.lock:
+                stats.errors[type(error).__name__] += 1
+        time.sleep(behaviour.think_time(rng))
+
+
+def converse(health_bot, rng: random.Random, behaviour: Behaviour,
+             deadline: float, stats: Stats) -> bool:
+    """One conversation, answering every UserInputRequest after a think
+    time. Returns False if it was cut short by the deadline."""
+    topics = 1
+    session = health_bot.HealthBotSession(rng.choice(QUESTIONS))
+    conversation = session.run_conversation()
+    kind, started = "question", time.perf_counter()
+    try:
+        response = next(conversation)
+        while True:
+            if not isinstance(response, health_bot.UserInputRequest):
+                response = next(conversation)
+                continue
+            stats.turn(kind, time.perf_counter() - started)
+            time.sleep(behaviour.think_time(rng))
+            if time.monotonic() >= deadline:
+                return False
+            kind = response.input_type
+            if kind == "quiz_choice":
+                answer = "yes" if rng.random() < behaviour.quiz_rate \
+                    else "no"
+            elif kind == "new_topic_choice":
+                more = topics < behaviour.max_topics and \
+                    rng.random() < behaviour.new_topic_rate
+                answer = "yes" if more else "no"
+            elif kind == "new_question":
+                topics += 1
+                answer = rng.choice(QUESTIONS)
+            else:  # quiz_answer
+                answer = "It improves sleep and lowers blood pressure."
+            started = time.perf_counter()
+            response = conversation.send(answer)
+    except StopIteration:
+        stats.turn(kind, time.perf_counter() - started)
+        return True
+    finally:
+        conversation.close()
+
+
+def sample_rss(stats: Stats, started: float, interval: float,
+               stop: threading.Event):
+    while True:
+        stats.rss.append((time.monotonic() - started, rss_mib()))
+        if stop.wait(interval):
+            stats.rss.append((time.monotonic() - started, rss_mib()))
+            return
+
+
+def run_stage(health_bot, users: int, duration: float, ramp: float,
+              behaviour: Behaviour, sample_interval: float,
+              seed: int) -> dict:
+    stats = Stats()
+    started = time.monotonic()
+    deadline = started + duration
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_rss, daemon=True,
+                               args=(stats, started, sample_interval, stop))
+    sampler.start()
+    threads = []
+    for number in range(users):
+        thread = threading.Thread(
+            target=virtual_user, daemon=True,
+            args=(health_bot, number, behaviour, deadline, stats, seed))
+        thread.start()
+        threads.append(thread)
+        time.sleep(ramp / users)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    stop.set()
+    sampler.join()
+
+    turns = sum(map(len, stats.turns.values()))
+    return {
+        "users": users,
+        "seconds": round(elapsed, 1),
+        "conversations": stats.conversations,
+        "completed": stats.completed,
+        "turns_per_second": round(turns / elapsed, 2),
+        "conversations_per_second": round(stats.completed / elapsed, 3),
+        "error_rate": round(sum(stats.errors.values())
+                            / max(stats.conversations, 1), 4),
+        "errors": dict(stats.errors),
+        "latency_ms": {
+            kind: {"count": len(values),
+                   "p50": round(percentile(values, 50) * 1000, 1),
+                   "p95": round(percentile(values, 95) * 1000, 1),
+                   "p99": round(percentile(values, 99) * 1000, 1),
+                   "mean": round(statistics.fmean(values) * 1000, 1)}
+            for kind, values in sorted(stats.turns.items())},
+        "rss_mib": [(round(t, 1), round(mib, 1)) for t, mib in stats.rss],
+    }
+
+
+def print_stage(stage: dict):
+    rss = stage["rss_mib"]
+    print(f"{stage['users']} users, {stage['seconds']}s: "
+          f"{stage['turns_per_second']} turns/s, "
+          f"{stage['conversations_per_second']} conversations/s, "
+          f"error rate {stage['error_rate']:.1%} {stage['errors'] or ''}")
+    print(f"  {'turn':>16}  {'count':>6}  {'p50 ms':>8}  {'p95 ms':>8}  "
+          f"{'p99 ms':>8}")
+    for kind, latency in stage["latency_ms"].items():
+        print(f"  {kind:>16}  {latency['count']:>6}  {latency['p50']:>8}  "
+              f"{latency['p95']:>8}  {latency['p99']:>8}")
+    print(f"  RSS {rss[0][1]} -> {rss[-1][1]} MiB "
+          f"({rss[-1][1] - rss[0][1]:+.1f}), peak "
+          f"{max(mib for _, mib in rss)} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="10",
+                        help="comma separated virtual users per stage")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds per stage")
+    parser.add_argument("--ramp", type=float, default=2,
+                        help="seconds over which a stage's users start")
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="mean think time before each answer (s)")
+    parser.add_argument("--think-jitter", type=float, default=0.3)
+    parser.add_argument("--quiz-rate", type=float, default=0.5,
+                        help="share of quizzes accepted")
+    parser.add_argument("--new-topic-rate", type=float, default=0.3,
+                        help="share of conversations continued with "
+                             "another topic")
+    parser.add_argument("--max-topics", type=int, default=3)
+    parser.add_argument("--upstream", choices=["stub", "env"],
+                        default="stub")
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--search-latency", type=float, default=0.4)
+    parser.add_argument("--search-jitter", type=float, default=0.1)
+    parser.add_argument("--sample-interval", type=float, default=1.0,
+                        help="seconds between RSS samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the stage reports here")
+    args = parser.parse_args()
+
+    if args.upstream == "stub":
+        llm = chat_server(latency=args.llm_latency,
+                          jitter=args.llm_jitter).start()
+        search = search_server(latency=args.search_latency,
+                               jitter=args.search_jitter).start()
+        os.environ.update(OPENAI_BASE_URL=f"{llm.url}/v1",
+                          TAVILY_API_URL=search.url,
+                          OPENAI_API_KEY="load-test",
+                          TAVILY_API_KEY="load-test")
+        os.environ.setdefault("TRACING", "off")
+    # Imported once the environment points at the upstreams
+    import health_bot
+
+    behaviour = Behaviour(args.think, args.think_jitter, args.quiz_rate,
+                          args.new_topic_rate, args.max_topics)
+    stages = []
+    for users in map(int, args.users.split(",")):
+        stage = run_stage(health_bot, users, args.duration, args.ramp,
+                          behaviour, args.sample_interval, args.seed)
+        print_stage(stage)
+        stages.append(stage)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(stages, f, indent=2)
@@ -0,0 +1,66 @@
+"""Checks the pooled search client against the local stand-in server:
+single-flight coalescing of concurrent identical searches, retry on 429/5xx
+and throughput of distinct searches.
+
+    python -m benchmarks.search_client
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_servers import search_server
+from search_client import AsyncSearchClient, SearchClient, SearchError
+
+
+def check_sync(server):
+    client = SearchClient(base_url=server.url, max_connections=8,
+                          backoff=0.01)
+
+    server.requests.clear()
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        responses = list(pool.map(lambda _: client.search("Sleep hygiene"),
+                                  range(20)))
+    assert all(r == responses[0] for r in responses)
+    print(f"sync:  20 identical concurrent searches -> "
+          f"{len(server.requests)} upstream request(s), "
+          f"{client.coalesced} coalesced")
+
+    server.failures = [429, 503]
+    client.search("retry me")
+    print(f"sync:  429, 503 then 200 -> {client.retries} retries")
+
+    server.failures = [400]
+    try:
+        client.search("bad request")
+    except SearchError as error:
+        print(f"sync:  400 is not retried -> {error}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(lambda i: client.search(f"topic {i}"), range(64)))
+    elapsed = time.perf_counter() - started
+    print(f"sync:  64 distinct searches, 8 connections: {elapsed:.2f}s")
+
+
+async def check_async(server):
+    client = AsyncSearchClient(base_url=server.url, max_connections=8,
+                               backoff=0.01)
+    server.requests.clear()
+    responses = await asyncio.gather(
+        *(client.search("Sleep hygiene") for _ in range(20)))
+    assert all(r == responses[0] for r in responses)
+    print(f"async: 20 identical concurrent searches -> "
+          f"{len(server.requests)} upstream request(s), "
+          f"{client.coalesced} coalesced")
+
+    server.failures = [502]
+    await client.search("retry me async")
+    print(f"async: 502 then 200 -> {client.retries} retries")
+    await client.client.aclose()
+
+
+if __name__ == "__main__":
+    server = search_server(latency=0.2).start()
+    check_sync(server)
+    asyncio.run(check_async(server))
+    server.shutdown()
@@ -0,0 +1,138 @@
+"""Quiz turn latency with SPECULATIVE_QUIZ while batch work saturates the
+LLM concurrency limit.
+
+    python -m benchmarks.speculation --concurrency 2 --batch-threads 8
+
+During each conversation, background threads keep more BATCH calls queued
+than the scheduler admits, until --batch-calls have been made. For each
+mode the quiz flow of benchmarks.conversation is run --runs times and the
+time from accepting the quiz to seeing the question is reported:
+
+    off         the question is generated when the quiz is accepted
+    on          it is generated while the user thinks; accepting raises
+                its queued call to the user's priority
+    unpromoted  as on, but the claimed call keeps SPECULATIVE priority, so
+                it waits for the batch calls to run out (the old
+                behaviour)
+"""
+import argparse
+import itertools
+import os
+import threading
+import time
+
+from langchain_core.messages import HumanMessage
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import health_bot
+import scheduler
+from benchmarks import fakes, percentile
+from benchmarks.conversation import FLOWS
+
+MODES = ("off", "on", "unpromoted")
+
+
+class BatchLoad:
+    """Threads making BATCH priority LLM calls back to back until calls
+    have been made"""
+
+    def __init__(self, threads: int, calls: int):
+        self.stopped = threading.Event()
+        self.budget = calls
+        self.calls = itertools.count()
+        self.threads = [threading.Thread(target=self._run, daemon=True)
+                        for _ in range(threads)]
+
+    def _run(self):
+        with scheduler.priority(scheduler.BATCH):
+            while not self.stopped.is_set():
+                call = next(self.calls)
+                if call >= self.budget:
+                    return
+                health_bot.call_llm("summarize", [HumanMessage(
+                    f"Background summary {call}")])
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def quiz_turn(think: float) -> float:
+    """Seconds from accepting the quiz to the quiz question, for one
+    conversation through the quiz flow"""
+    question, answers = FLOWS["quiz"]
+    answers = iter(answers)
+    conversation = health_bot.HealthBotSession(question).run_conversation()
+    seconds = None
+    accepted = None
+    try:
+        response = next(conversation)
+        while True:
+            if isinstance(response, health_bot.UserInputRequest):
+                if response.input_type == "quiz_choice":
+                    time.sleep(think)
+                    accepted = time.perf_counter()
+                response = conversation.send(next(answers))
+            else:
+                if accepted is not None and seconds is None:
+                    seconds = time.perf_counter() - accepted
+                response = next(conversation)
+    except StopIteration:
+        return seconds
+
+
+def run_mode(mode: str, runs: int, think: float, batch_threads: int,
+             batch_calls: int) -> dict:
+    health_bot.speculative_quiz = mode != "off"
+    promote = scheduler.Ticket.promote
+    if mode == "unpromoted":
+        scheduler.Ticket.promote = lambda ticket, priority_class: None
+    try:
+        turns = []
+        for _ in range(runs):
+            health_bot.search_cache.clear()
+            with BatchLoad(batch_threads, batch_calls):
+                turns.append(quiz_turn(think))
+    finally:
+        scheduler.Ticket.promote = promote
+    return {"p50_ms": round(percentile(turns, 50) * 1000, 1),
+            "p95_ms": round(percentile(turns, 95) * 1000, 1),
+            "max_ms": round(max(turns) * 1000, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=2,
+                        help="SCHEDULER_LLM_CONCURRENCY")
+    parser.add_argument("--batch-threads", type=int, default=8,
+                        help="threads making batch calls")
+    parser.add_argument("--batch-calls", type=int, default=40,
+                        help="batch calls per conversation")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--think", type=float, default=0.05,
+                        help="seconds before the user accepts the quiz")
+    parser.add_argument("--mode", action="append", choices=MODES)
+    args = parser.parse_args()
+
+    fakes.install(health_bot, fakes.FakeChatModel(latency=args.llm_latency,
+                                                  words=20))
+    health_bot.call_scheduler = scheduler.Scheduler({
+        "llm": scheduler.Upstream("llm", args.concurrency),
+        "search": scheduler.Upstream("search"),
+    })
+    print(f"LLM concurrency {args.concurrency}, {args.batch_threads} batch "
+          f"threads, {args.llm_latency * 1000:.0f} ms per call")
+    for mode in args.mode or MODES:
+        result = run_mode(mode, args.runs, args.think, args.batch_threads,
+                          args.batch_calls)
+        print(f"  speculation {mode:>10}: quiz turn p50 "
+              f"{result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms, "
+              f"max {result['max_ms']:.0f} ms")
@@ -0,0 +1,91 @@
+"""Startup-time benchmark: how long importing health_bot takes, and how long
+building the LLM client and compiled graph takes on first use.
+
+Each measurement runs in a fresh interpreter, like a Streamlit cold start or
+a new worker process. Two modes are reported: lazy, the module as it is,
+and eager, where the LLM client and graph are built during the import, as
+before they were built on first use. With --rev the eager numbers come from
+that git revision of the repository instead (e.g. the commit before lazy
+loading); its module may need network access at import.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --rev <commit>
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules from before lazy loading have no get_llm()/get_graph(); they
+# built llm and graph at import
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import health_bot
+def ready():
+    if hasattr(health_bot, "get_graph"):
+        health_bot.get_llm()
+        health_bot.get_graph()
+if sys.argv[1] == "eager":
+    ready()
+imported = time.perf_counter()
+ready()
+used = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_use": used - imported}))
+"""
+
+
+def measure(runs: int, mode: str = "lazy", root: str = ROOT) -> dict:
+    env = dict(os.environ)
+    # Only client construction is measured, no request is sent
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    samples = []
+    for _ in range(runs):
+        probe = subprocess.run([sys.executable, "-c", PROBE, mode],
+                               cwd=root, env=env, capture_output=True,
+                               text=True)
+        if probe.returncode:
+            sys.exit(f"{mode} probe in {root} failed:\n{probe.stderr}")
+        samples.append(json.loads(probe.stdout.strip().splitlines()[-1]))
+    return {
+        phase: {
+            "median": statistics.median(s[phase] for s in samples),
+            "min": min(s[phase] for s in samples),
+        }
+        for phase in ("import", "first_use")
+    }
+
+
+def checkout(rev: str, path: str):
+    """Extract the tree of git revision rev into path"""
+    archive = os.path.join(path, "tree.tar")
+    subprocess.run(["git", "archive", "--output", archive, rev], cwd=ROOT,
+                   check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rev", help="measure eager startup with the "
+                                      "health_bot of this git revision")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as baseline:
+        if args.rev:
+            checkout(args.rev, baseline)
+        results = {"lazy": measure(args.runs),
+                   "eager": measure(args.runs, "eager",
+                                    baseline if args.rev else ROOT)}
+    for mode, phases in results.items():
+        total = sum(stats["median"] for stats in phases.values())
+        print(f"{mode}: import {phases['import']['median'] * 1000:.1f} ms, "
+              f"first use {phases['first_use']['median'] * 1000:.1f} ms, "
+              f"total {total * 1000:.1f} ms (medians)")
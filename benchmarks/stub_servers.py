@@ -0,0 +1,253 @@
+"""Local stand-ins for the upstream HTTP APIs, for benchmarks and for
+checking client behaviour without network access or API costs.
+
+    python -m benchmarks.stub_servers --port 8765
+    python -m benchmarks.stub_servers --api llm --port 8766
+
+then point the bot at them with TAVILY_API_URL=http://127.0.0.1:8765 and
+OPENAI_BASE_URL=http://127.0.0.1:8766/v1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server that records the requests it served"""
+    daemon_threads = True
+
+    def __init__(self, handler, port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0):
+        super().__init__(("127.0.0.1", port), handler)
+        self.latency = latency
+        self.jitter = jitter
+        # Status codes to answer the next requests with, e.g. [429, 503]
+        self.failures = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def delay(self):
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def injected_failure(self) -> bool:
+        with self.server.lock:
+            status = self.server.failures.pop(0) if self.server.failures \
+                else None
+        if status is None:
+            return False
+        self.send_json(status, {"detail": "injected failure"},
+                       {"Retry-After": "0"} if status == 429 else None)
+        return True
+
+
+class SearchHandler(StubHandler):
+    """Tavily-compatible POST /search with deterministic results"""
+
+    results_per_query = 5
+    content_words = 120
+
+    def do_POST(self):
+        body = self.read_json()
+        with self.server.lock:
+            self.server.requests.append(body)
+        self.server.delay()
+        if self.injected_failure():
+            return
+        query = body.get("query", "")
+        self.send_json(200, search_response(query, self.results_per_query,
+                                            self.content_words))
+
+
+def search_response(query: str, results: int = 5, words: int = 120) -> dict:
+    """Deterministic Tavily-shaped response for query"""
+    slug = "-".join(query.lower().split()) or "empty"
+    filler = ("Researchers report that regular habits matter for long term "
+              "health outcomes and wellbeing. ").split()
+    return {
+        "query": query,
+        "results": [
+            {
+                "url": f"https://health.example/{slug}/{i}",
+                "title": f"{query} - source {i}",
+                "content": f"{query}: " + " ".join(
+                    filler[(i + j) % len(filler)] for j in range(words)),
+                "score": round(1.0 - i / (results + 1), 3),
+            }
+            for i in range(results)
+        ],
+        "response_time": 0.0,
+    }
+
+
+def search_server(port: int = 0, latency: float = 0.0,
+                  jitter: float = 0.0) -> StubServer:
+    return StubServer(SearchHandler, port, latency, jitter)
+
+
+class ChatHandler(StubHandler):
+    """OpenAI-compatible POST /v1/chat/completions (plain and streamed)
+    that answers like benchmarks.fakes.FakeChatModel"""
+
+    words = 150
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        body = self.read_json()
+        with self.server.lock:
+            self.server.requests.append(body)
+        self.server.delay()
+        if self.injected_failure():
+            return
+        # Imported here: benchmarks.fakes imports this module
+        from benchmarks.fakes import FakeChatModel
+        model = FakeChatModel(
+            words=self.words, tools=body.get("tools") or None,
+            max_tokens=body.get("max_completion_tokens") or
+            body.get("max_tokens"))
+        message = model.reply(chat_messages(body["messages"]))
+        completion = chat_completion(message, body.get("model", "stub"))
+        if body.get("stream"):
+            self.send_stream(completion, body.get("stream_options") or {})
+        else:
+            self.send_json(200, completion)
+
+    def send_stream(self, completion: dict, options: dict):
+        # Server-sent events, one chunk per word, then the finish reason
+        choice = completion["choices"][0]
+        message = choice["message"]
+        deltas = [{"role": "assistant", "content": ""}]
+        deltas += [{"content": word} for word in
+                   _pieces(message.get("content") or "")]
+        if message.get("tool_calls"):
+            deltas.append({"tool_calls": [
+                {"index": i, **call}
+                for i, call in enumerate(message["tool_calls"])]})
+        chunks = [{"choices": [{"index": 0, "delta": delta,
+                                "finish_reason": None}]}
+                  for delta in deltas]
+        finish = choice["finish_reason"]
+        chunks.append({"choices": [{"index": 0, "delta": {},
+                                    "finish_reason": finish}]})
+        if options.get("include_usage"):
+            chunks.append({"choices": [], "usage": completion["usage"]})
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for chunk in chunks:
+            chunk.update(id=completion["id"], object="chat.completion.chunk",
+                         created=completion["created"],
+                         model=completion["model"])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def _pieces(text: str) -> list:
+    words = text.split(" ")
+    return [word if i == 0 else " " + word for i, word in enumerate(words)] \
+        if text else []
+
+
+def chat_messages(messages: list) -> list:
+    """LangChain messages from OpenAI chat messages"""
+    from langchain_core.messages import (AIMessage, HumanMessage,
+                                         SystemMessage, ToolMessage)
+    converted = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):  # content parts
+            content = "".join(part.get("text", "") for part in content)
+        role = message["role"]
+        if role == "tool":
+            converted.append(ToolMessage(
+                content, tool_call_id=message["tool_call_id"]))
+        elif role == "assistant":
+            converted.append(AIMessage(content))
+        elif role == "user":
+            converted.append(HumanMessage(content))
+        else:  # system or developer
+            converted.append(SystemMessage(content))
+    return converted
+
+
+def chat_completion(message, model: str) -> dict:
+    """OpenAI chat completion body for a LangChain AI message"""
+    tool_calls = [{"id": call["id"], "type": "function",
+                   "function": {"name": call["name"],
+                                "arguments": json.dumps(call["args"])}}
+                  for call in message.tool_calls]
+    usage = message.usage_metadata
+    reply = {"role": "assistant", "content": message.content or None}
+    if tool_calls:
+        reply["tool_calls"] = tool_calls
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": reply,
+                     "finish_reason": "tool_calls" if tool_calls
+                     else "stop"}],
+        "usage": {"prompt_tokens": usage["input_tokens"],
+                  "completion_tokens": usage["output_tokens"],
+                  "total_tokens": usage["total_tokens"]},
+    }
+
+
+def chat_server(port: int = 0, latency: float = 0.0,
+                jitter: float = 0.0) -> StubServer:
+    return StubServer(ChatHandler, port, latency, jitter)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a stand-in search or OpenAI chat API")
+    parser.add_argument("--api", choices=["search", "llm"], default="search")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3,
+                        help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.api == "llm":
+        server = chat_server(args.port, args.latency, args.jitter)
+        print(f"Stand-in OpenAI chat API on {server.url}/v1")
+    else:
+        server = search_server(args.port, args.latency, args.jitter)
+        print(f"Stand-in search API on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,81 @@
+"""Tokens sent and received per conversation turn, comparing two setups:
+
+    python -m benchmarks.tokens                    # old shared model vs
+                                                   # per-node profiles
+    python -m benchmarks.tokens --compare fused    # separate summary, quiz
+                                                   # and grading calls vs
+                                                   # FUSED_SUMMARY
+
+Runs the conversation flows of benchmarks.conversation against the fake
+LLM, which counts bound tool schemas as prompt tokens and honours each
+profile's output cap.
+"""
+import argparse
+from collections import defaultdict
+
+from benchmarks import conversation, fakes
+from benchmarks.conversation import FLOWS, converse, health_bot
+import metrics
+from model_profiles import LEGACY_PROFILE, profiles_from_env
+
+
+def tokens_by_node(question: str, answers: list) -> dict:
+    """{node: {"prompt": n, "completion": n}} used by one conversation"""
+    before = metrics.llm_tokens.snapshot()
+    converse(question, answers)
+    used = defaultdict(lambda: {"prompt": 0, "completion": 0})
+    for key, value in metrics.llm_tokens.snapshot().items():
+        node, kind = key.split("/")
+        if value != before.get(key, 0):
+            used[node][kind] += value - before.get(key, 0)
+    return dict(used)
+
+
+def measure(profiles: dict, fused: bool = False) -> dict:
+    health_bot.model_profiles = profiles
+    health_bot.fused_summary = fused
+    health_bot._llms.clear()
+    results = {}
+    for name, (question, answers) in FLOWS.items():
+        health_bot.search_cache.clear()
+        # One turn for the question and one per answer
+        results[name] = (tokens_by_node(question, answers), len(answers) + 1)
+    return results
+
+
+def print_comparison(before: dict, after: dict):
+    for flow in FLOWS:
+        (old, turns), (new, _) = before[flow], after[flow]
+        print(f"{flow} ({turns} turns)")
+        print(f"  {'node':>14}  {'prompt':>15}  {'completion':>15}")
+        for node in sorted(set(old) | set(new)):
+            o = old.get(node, {"prompt": 0, "completion": 0})
+            n = new.get(node, {"prompt": 0, "completion": 0})
+            print(f"  {node:>14}  {o['prompt']:>6} -> {n['prompt']:<6}"
+                  f"  {o['completion']:>6} -> {n['completion']:<6}")
+        old_total = sum(sum(usage.values()) for usage in old.values())
+        new_total = sum(sum(usage.values()) for usage in new.values())
+        print(f"  tokens per turn: {old_total / turns:.0f} -> "
+              f"{new_total / turns:.0f} "
+              f"({(new_total - old_total) / old_total:+.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--compare", choices=["profiles", "fused"],
+                        default="profiles")
+    parser.add_argument("--llm-words", type=int, default=150,
+                        help="words per fake LLM answer")
+    args = parser.parse_args()
+
+    fakes.install(health_bot, fakes.FakeChatModel(words=args.llm_words))
+    health_bot._graph = health_bot.build_graph(
+        conversation.TimedMemorySaver())
+    profiles = profiles_from_env()
+    if args.compare == "fused":
+        before = measure(profiles)
+        after = measure(profiles, fused=True)
+    else:
+        before = measure({node: LEGACY_PROFILE for node in profiles})
+        after = measure(profiles)
+    print_comparison(before, after)
@@ -0,0 +1,241 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Optional
+
+# Sentinel returned by Cache.get() on a miss, so that falsy values can be
+# cached
+MISS = object()
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a search query: case, whitespace and punctuation
+    are ignored, so "Benefits of meditation?" and "benefits  of meditation"
+    share one cache entry"""
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+@dataclass
+class CacheStats:
+    """Counters reported by a Cache"""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    # Upstream time (seconds) that hits did not have to spend again
+    saved_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "hit_rate": self.hit_rate}
+
+
+class MemoryStore:
+    """Thread-safe, size-bounded LRU store with per-entry expiry"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, cost, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str, stats: CacheStats):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS, 0.0
+            expires_at, cost, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                stats.expirations += 1
+                return MISS, 0.0
+            self._entries.move_to_end(key)
+            return value, cost
+
+    def set(self, key: str, value, expires_at: float, cost: float,
+            stats: CacheStats):
+        with self._lock:
+            self._entries[key] = (expires_at, cost, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """Persistent store shared by every process that opens the same file.
+
+    Values must be JSON serializable. The database runs in WAL mode so
+    concurrent readers from several workers do not block each other.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, last_access REAL NOT NULL,"
+                " cost REAL NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_last_access"
+                " ON cache(last_access)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, stats: CacheStats):
+        """(value, cost, expires_at), or (MISS, 0.0, 0.0)"""
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at, cost FROM cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return MISS, 0.0, 0.0
+            value, expires_at, cost = row
+            if expires_at < now:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                stats.expirations += 1
+                return MISS, 0.0, 0.0
+            conn.execute("UPDATE cache SET last_access = ? WHERE key = ?",
+                         (now, key))
+        return json.loads(value), cost, expires_at
+
+    def set(self, key: str, value, expires_at: float, cost: float,
+            stats: CacheStats):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache"
+                " (key, value, expires_at, last_access, cost)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now, cost)
+            )
+            # Drop expired rows first, then the least recently used ones
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            evicted = conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache"
+                " ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        stats.evictions += max(evicted, 0)
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class Cache:
+    """Two-tier cache: an in-memory LRU in front of an optional persistent
+    store. Entries found only in the persistent store are promoted to memory
+    until they expire there. The store holds store_entries entries (default
+    ten times max_entries), since it is shared by every worker.
+    """
+
+    def __init__(self, ttl: float, max_entries: int,
+                 path: Optional[str] = None,
+                 key_fn: Callable[[str], str] = lambda key: key,
+                 store_entries: Optional[int] = None):
+        self.ttl = ttl
+        self.key_fn = key_fn
+        self.stats = CacheStats()
+        self.memory = MemoryStore(max_entries)
+        if store_entries is None:
+            store_entries = max_entries * 10
+        self.store = SQLiteStore(path, store_entries) if path else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.max_entries > 0 and self.ttl > 0
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for key, or MISS"""
+        if not self.enabled:
+            return MISS
+        key = self.key_fn(key)
+        value, cost = self.memory.get(key, self.stats)
+        if value is MISS and self.store is not None:
+            value, cost, expires_at = self.store.get(key, self.stats)
+            if value is not MISS:
+                self.memory.set(key, value, expires_at, cost, self.stats)
+        if value is MISS:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+            self.stats.saved_seconds += cost
+        return value
+
+    def set(self, key: str, value, cost: float = 0.0):
+        """Cache value under key. cost is the time it took to produce it."""
+        if not self.enabled:
+            return
+        key = self.key_fn(key)
+        expires_at = time.time() + self.ttl
+        self.memory.set(key, value, expires_at, cost, self.stats)
+        if self.store is not None:
+            self.store.set(key, value, expires_at, cost, self.stats)
+
+    def clear(self):
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def report(self) -> dict:
+        """Hit/miss counters plus current sizes, e.g. for logging"""
+        report = self.stats.as_dict()
+        report["memory_entries"] = len(self.memory)
+        if self.store is not None:
+            report["store_entries"] = len(self.store)
+        return report
+
+    @classmethod
+    def from_env(cls, prefix: str, ttl: float, max_entries: int,
+                 key_fn: Callable[[str], str] = lambda key: key) -> "Cache":
+        """Build a cache configured by <prefix>_TTL, <prefix>_SIZE,
+        <prefix>_PATH and <prefix>_STORE_SIZE environment variables. A size
+        or TTL of 0 disables the cache; a path enables the shared SQLite
+        store, which holds <prefix>_STORE_SIZE entries (default ten times
+        the size)."""
+        store_entries = os.getenv(f"{prefix}_STORE_SIZE")
+        return cls(
+            ttl=float(os.getenv(f"{prefix}_TTL", ttl)),
+            max_entries=int(os.getenv(f"{prefix}_SIZE", max_entries)),
+            path=os.getenv(f"{prefix}_PATH") or None,
+            key_fn=key_fn,
+            store_entries=int(store_entries) if store_entries else None,
+        )
@@ -0,0 +1,294 @@
+"""Compact serializer for graph checkpoints.
+
+LangGraph already encodes checkpoints as msgpack. CompactSerializer adds:
+
+- compression of every value larger than min_compress bytes, with zstd if
+  the zstandard package is installed and zlib otherwise;
+- optionally, moving large strings (message contents such as raw search
+  results, the summary, the compacted context) to a content-addressed
+  payload store. A checkpoint then holds a short reference, and an
+  unchanged message re-written by every later checkpoint of the thread is
+  stored once.
+
+Values written by the default serializer stay readable, so it can be
+switched on for an existing CHECKPOINT_PATH.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Optional
+
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Replaces an externalized string; followed by the payload's SHA-256
+PAYLOAD_PREFIX = "\x00payload:"
+# Content of a payload that expired from the store
+EXPIRED = "[content no longer available]"
+
+
+def compress(data: bytes, level: int = 3) -> tuple:
+    """(codec, compressed data)"""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=level).compress(data)
+    return "zlib", zlib.compress(data, level)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown checkpoint codec {codec!r}")
+
+
+class MemoryPayloadStore:
+    """Payloads in process memory. A payload not read or written for
+    idle_ttl seconds is dropped."""
+
+    def __init__(self, idle_ttl: float):
+        self.idle_ttl = idle_ttl
+        self._payloads = OrderedDict()  # digest -> (last access, data)
+        self._lock = threading.Lock()
+
+    def put(self, digest: str, data: bytes) -> bool:
+        """Store data; False if it was already stored"""
+        now = time.time()
+        with self._lock:
+            new = digest not in self._payloads
+            self._payloads[digest] = (now, data)
+            self._payloads.move_to_end(digest)
+            while self._payloads:
+                oldest, (last_access, _) = next(iter(self._payloads.items()))
+                if last_access >= now - self.idle_ttl:
+                    break
+                del self._payloads[oldest]
+        return new
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._payloads.get(digest)
+            if entry is None:
+                return None
+            self._payloads[digest] = (time.time(), entry[1])
+            self._payloads.move_to_end(digest)
+            return entry[1]
+
+    def bytes_held(self) -> int:
+        return sum(len(data) for _, data in list(self._payloads.values()))
+
+    def __len__(self):
+        return len(self._payloads)
+
+
+class SQLitePayloadStore:
+    """Payloads in a SQLite file (usually the CHECKPOINT_PATH one), shared
+    by every process using it. Payloads idle for idle_ttl seconds are
+    deleted."""
+
+    def __init__(self, path: str, idle_ttl: float):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._puts = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS payloads ("
+                " digest TEXT PRIMARY KEY, data BLOB NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS payloads_last_access"
+                " ON payloads(last_access)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, digest: str, data: bytes) -> bool:
+        now = time.time()
+        with self._connection() as conn:
+            new = conn.execute(
+                "INSERT OR IGNORE INTO payloads VALUES (?, ?, ?)",
+                (digest, data, now)
+            ).rowcount > 0
+            if not new:
+                conn.execute(
+                    "UPDATE payloads SET last_access = ? WHERE digest = ?",
+                    (now, digest))
+            self._puts += 1
+            if self._puts % 100 == 0:
+                conn.execute("DELETE FROM payloads WHERE last_access < ?",
+                             (now - self.idle_ttl,))
+        return new
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT data FROM payloads WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE payloads SET last_access = ? WHERE digest = ?",
+                    (time.time(), digest))
+        return row[0] if row else None
+
+    def bytes_held(self) -> int:
+        return self._connection().execute(
+            "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM payloads"
+        ).fetchone()[0]
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM payloads").fetchone()[0]
+
+
+class CompactSerializer:
+    """Checkpoint serializer (LangGraph SerializerProtocol) that compresses
+    values and, given a payload store, externalizes strings of at least
+    min_payload bytes"""
+
+    def __init__(self, payloads=None, min_payload: int = 1024,
+                 min_compress: int = 128, level: int = 3):
+        self._serde = JsonPlusSerializer()
+        self.payloads = payloads
+        self.min_payload = min_payload
+        self.min_compress = min_compress
+        self.level = level
+        self.raw_bytes = 0  # msgpack bytes before compression
+        self.stored_bytes = 0
+        self.externalized = 0
+        self.deduplicated = 0  # Payloads that were already stored
+        self.expired = 0
+
+    def dumps_typed(self, obj: Any) -> tuple:
+        if self.payloads is not None:
+            obj = self._externalize(obj)
+        type_, data = self._serde.dumps_typed(obj)
+        self.raw_bytes += len(data)
+        if len(data) >= self.min_compress and type_ in ("msgpack", "json"):
+            codec, compressed = compress(data, self.level)
+            if len(compressed) < len(data):
+                type_, data = f"{type_}+{codec}", compressed
+        self.stored_bytes += len(data)
+        return type_, data
+
+    def loads_typed(self, data: tuple) -> Any:
+        type_, payload = data
+        type_, _, codec = type_.partition("+")
+        if codec:
+            payload = decompress(codec, payload)
+        obj = self._serde.loads_typed((type_, payload))
+        if self.payloads is not None:
+            obj = self._internalize(obj)
+        return obj
+
+    # Channel values (str, list of messages), node writes (a message or a
+    # list of them) and checkpoints that hold their channel values inline
+    # (SqliteSaver) are searched for payloads; nothing else is
+    def _externalize(self, obj):
+        if isinstance(obj, dict) and "channel_values" in obj:
+            return {**obj, "channel_values": {
+                channel: self._externalize(value)
+                for channel, value in obj["channel_values"].items()}}
+        if isinstance(obj, str):
+            return self._put(obj)
+        if isinstance(obj, BaseMessage):
+            return self._put_message(obj)
+        if isinstance(obj, list):
+            return [self._put_message(item)
+                    if isinstance(item, BaseMessage) else item
+                    for item in obj]
+        return obj
+
+    def _internalize(self, obj):
+        if isinstance(obj, dict) and "channel_values" in obj:
+            return {**obj, "channel_values": {
+                channel: self._internalize(value)
+                for channel, value in obj["channel_values"].items()}}
+        if isinstance(obj, str):
+            return self._get(obj)
+        if isinstance(obj, BaseMessage):
+            return self._get_message(obj)
+        if isinstance(obj, list):
+            return [self._get_message(item)
+                    if isinstance(item, BaseMessage) else item
+                    for item in obj]
+        return obj
+
+    def _put(self, text: str) -> str:
+        data = text.encode()
+        if len(data) < self.min_payload:
+            return text
+        digest = hashlib.sha256(data).hexdigest()
+        codec, compressed = compress(data, self.level)
+        self.externalized += 1
+        if not self.payloads.put(digest, codec.encode() + b":" + compressed):
+            self.deduplicated += 1
+        return PAYLOAD_PREFIX + digest
+
+    def _get(self, text: str) -> str:
+        if not text.startswith(PAYLOAD_PREFIX):
+            return text
+        stored = self.payloads.get(text[len(PAYLOAD_PREFIX):])
+        if stored is None:
+            self.expired += 1
+            return EXPIRED
+        codec, _, data = stored.partition(b":")
+        return decompress(codec.decode(), data).decode()
+
+    def _put_message(self, message: BaseMessage) -> BaseMessage:
+        if isinstance(message.content, str):
+            content = self._put(message.content)
+            if content is not message.content:
+                return message.model_copy(update={"content": content})
+        return message
+
+    def _get_message(self, message: BaseMessage) -> BaseMessage:
+        if isinstance(message.content, str) and \
+                message.content.startswith(PAYLOAD_PREFIX):
+            return message.model_copy(
+                update={"content": self._get(message.content)})
+        return message
+
+    def report(self) -> dict:
+        report = {"raw_bytes": self.raw_bytes,
+                  "stored_bytes": self.stored_bytes,
+                  "externalized": self.externalized,
+                  "deduplicated": self.deduplicated,
+                  "expired": self.expired}
+        if self.payloads is not None:
+            report["payloads"] = len(self.payloads)
+            report["payload_bytes"] = self.payloads.bytes_held()
+        return report
+
+
+def serde_from_env(path: Optional[str], idle_ttl: float):
+    """CompactSerializer if CHECKPOINT_COMPRESSION=true, else None (the
+    default serializer). CHECKPOINT_PAYLOAD_BYTES=<n> externalizes strings
+    of at least n bytes, into the SQLite file at path if given. Payloads
+    are kept for twice the checkpoint idle TTL, so they outlive the
+    threads that use them."""
+    if os.getenv("CHECKPOINT_COMPRESSION", "False").lower() != "true":
+        return None
+    min_payload = int(os.getenv("CHECKPOINT_PAYLOAD_BYTES", 0))
+    payloads = None
+    if min_payload:
+        payloads = SQLitePayloadStore(path, 2 * idle_ttl) if path \
+            else MemoryPayloadStore(2 * idle_ttl)
+    return CompactSerializer(payloads, min_payload=min_payload or 1024)
@@ -0,0 +1,313 @@
+import asyncio
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from checkpoint_serde import serde_from_env
+
+
+class BoundedThreads:
+    """Mixin for checkpointers that forgets idle threads.
+
+    Every write to a thread counts as activity; reads do not, so looking up
+    an unknown thread_id does not create an entry that could push out a
+    real conversation. Threads idle for longer than idle_ttl seconds are
+    deleted, and when more than max_threads threads are stored the least
+    recently used ones are deleted first. Eviction runs inline on writes,
+    at most once every evict_interval seconds, so no background thread is
+    needed; in between, max_threads may be exceeded by the threads started
+    meanwhile.
+    """
+
+    def _init_bounds(self, max_threads: int, idle_ttl: float,
+                     evict_interval: float = 0):
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self.evict_interval = evict_interval
+        self.evicted_threads = 0
+        self._bounds_lock = threading.RLock()
+        self._evicted_at = float("-inf")
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        with self._bounds_lock:
+            self._touch(thread_id)
+            if time.monotonic() - self._evicted_at >= self.evict_interval:
+                self._evict(keep=thread_id)
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        self._touch(config["configurable"]["thread_id"])
+        return super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str):
+        with self._bounds_lock:
+            self._forget(thread_id)
+        super().delete_thread(thread_id)
+
+    def lease(self, thread_id: str, seconds: float) -> Optional[str]:
+        """Reserve thread_id for one caller, e.g. a reply being handled, for
+        up to seconds. Returns a token for release(), or None if someone
+        else holds an unexpired lease, in this or another process."""
+        token = uuid.uuid4().hex
+        with self._bounds_lock:
+            if self._lease(thread_id, token, time.time() + seconds):
+                return token
+        return None
+
+    def release(self, thread_id: str, token: str):
+        with self._bounds_lock:
+            self._release_lease(thread_id, token)
+
+    def _evict(self, keep: str):
+        self._evicted_at = time.monotonic()
+        for thread_id in self._stale_threads(keep):
+            self.evicted_threads += 1
+            self.delete_thread(thread_id)
+
+    def evict_idle(self):
+        """Delete idle threads now, without waiting for the next write"""
+        with self._bounds_lock:
+            self._evict(keep=None)
+
+    def metrics(self) -> dict:
+        metrics = {
+            "live_threads": self.live_threads(),
+            "bytes_held": self.bytes_held(),
+            "evicted_threads": self.evicted_threads,
+        }
+        # Compression and payload counters of a CompactSerializer
+        if hasattr(self.serde, "report"):
+            metrics.update({f"serde_{key}": value
+                            for key, value in self.serde.report().items()})
+        return metrics
+
+
+class BoundedMemorySaver(BoundedThreads, MemorySaver):
+    """In-process checkpointer with idle-thread TTL and LRU eviction"""
+
+    def __init__(self, max_threads: int = 1000, idle_ttl: float = 60 * 60,
+                 serde=None):
+        super().__init__(serde=serde)
+        self._init_bounds(max_threads, idle_ttl)
+        self._last_access = OrderedDict()  # thread_id -> time, oldest first
+        self._leases = {}  # thread_id -> (token, expires_at)
+
+    def _touch(self, thread_id: str):
+        with self._bounds_lock:
+            self._last_access[thread_id] = time.time()
+            self._last_access.move_to_end(thread_id)
+
+    def _forget(self, thread_id: str):
+        self._last_access.pop(thread_id, None)
+        self._leases.pop(thread_id, None)
+
+    def _lease(self, thread_id: str, token: str, expires_at: float) -> bool:
+        held = self._leases.get(thread_id)
+        if held is not None and held[1] > time.time():
+            return False
+        self._leases[thread_id] = (token, expires_at)
+        return True
+
+    def _release_lease(self, thread_id: str, token: str):
+        if self._leases.get(thread_id, (None,))[0] == token:
+            del self._leases[thread_id]
+
+    def _stale_threads(self, keep: Optional[str]) -> list:
+        deadline = time.time() - self.idle_ttl
+        excess = len(self._last_access) - self.max_threads
+        stale = []
+        for thread_id, last_access in self._last_access.items():
+            if excess <= 0 and last_access >= deadline:
+                break
+            if thread_id != keep:
+                stale.append(thread_id)
+                excess -= 1
+        return stale
+
+    def live_threads(self) -> int:
+        return len(self._last_access)
+
+    def active_threads(self, within: float) -> int:
+        """Threads written to in the last within seconds"""
+        since = time.time() - within
+        with self._bounds_lock:
+            return sum(1 for _ in itertools.takewhile(
+                lambda last_access: last_access >= since,
+                reversed(self._last_access.values())))
+
+    def bytes_held(self) -> int:
+        """Size of all serialized checkpoints, channel values and writes"""
+        total = 0
+        for namespaces in list(self.storage.values()):
+            for checkpoints in list(namespaces.values()):
+                for checkpoint, metadata, _ in list(checkpoints.values()):
+                    total += len(checkpoint[1]) + len(metadata[1])
+        for _, value in list(self.blobs.values()):
+            total += len(value)
+        for writes in list(self.writes.values()):
+            for _, _, value, _ in list(writes.values()):
+                total += len(value[1])
+        return total
+
+
+def bounded_sqlite_saver(path: str, max_threads: int = 100_000,
+                         idle_ttl: float = 24 * 60 * 60, serde=None,
+                         evict_interval: float = 1.0):
+    """Checkpointer that keeps state in a SQLite file (WAL mode) instead of
+    the process heap. Access times are stored in the database, so TTL and
+    LRU eviction apply across every process sharing the file. Requires the
+    langgraph-checkpoint-sqlite package."""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class BoundedSqliteSaver(BoundedThreads, SqliteSaver):
+
+        def __init__(self):
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            super().__init__(conn, serde=serde)
+            self._init_bounds(max_threads, idle_ttl, evict_interval)
+            with self.cursor() as cur:
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS thread_access ("
+                    " thread_id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+                )
+                # Eviction reads the oldest threads off this index instead
+                # of scanning and sorting the table
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS thread_access_last_access"
+                    " ON thread_access(last_access)"
+                )
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS thread_leases ("
+                    " thread_id TEXT PRIMARY KEY, token TEXT NOT NULL,"
+                    " expires_at REAL NOT NULL)"
+                )
+
+        def _touch(self, thread_id: str):
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT OR REPLACE INTO thread_access VALUES (?, ?)",
+                    (thread_id, time.time())
+                )
+
+        def _forget(self, thread_id: str):
+            with self.cursor() as cur:
+                cur.execute("DELETE FROM thread_access WHERE thread_id = ?",
+                            (thread_id,))
+                cur.execute("DELETE FROM thread_leases WHERE thread_id = ?",
+                            (thread_id,))
+
+        def _lease(self, thread_id: str, token: str,
+                   expires_at: float) -> bool:
+            # One statement, so concurrent leases from several processes
+            # cannot both succeed
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO thread_leases VALUES (?, ?, ?)"
+                    " ON CONFLICT(thread_id) DO UPDATE"
+                    " SET token = excluded.token,"
+                    " expires_at = excluded.expires_at"
+                    " WHERE thread_leases.expires_at < ?",
+                    (thread_id, token, expires_at, time.time())
+                )
+                return cur.rowcount > 0
+
+        def _release_lease(self, thread_id: str, token: str):
+            with self.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM thread_leases"
+                    " WHERE thread_id = ? AND token = ?", (thread_id, token))
+
+        def _stale_threads(self, keep: Optional[str]) -> list:
+            deadline = time.time() - self.idle_ttl
+            with self.cursor(transaction=False) as cur:
+                idle = cur.execute(
+                    "SELECT thread_id FROM thread_access"
+                    " WHERE last_access < ?", (deadline,)
+                ).fetchall()
+                excess = cur.execute(
+                    "SELECT COUNT(*) FROM thread_access").fetchone()[0] \
+                    - len(idle) - self.max_threads
+                oldest = cur.execute(
+                    "SELECT thread_id FROM thread_access"
+                    " WHERE last_access >= ? ORDER BY last_access LIMIT ?",
+                    (deadline, excess)
+                ).fetchall() if excess > 0 else []
+            stale = {row[0] for row in idle + oldest}
+            stale.discard(keep)
+            return list(stale)
+
+        def live_threads(self) -> int:
+            with self.cursor(transaction=False) as cur:
+                return cur.execute(
+                    "SELECT COUNT(*) FROM thread_access").fetchone()[0]
+
+        def active_threads(self, within: float) -> int:
+            with self.cursor(transaction=False) as cur:
+                return cur.execute(
+                    "SELECT COUNT(*) FROM thread_access"
+                    " WHERE last_access >= ?", (time.time() - within,)
+                ).fetchone()[0]
+
+        def bytes_held(self) -> int:
+            """Size of all serialized checkpoints and writes in the file"""
+            with self.cursor(transaction=False) as cur:
+                checkpoints = cur.execute(
+                    "SELECT COALESCE(SUM(LENGTH(checkpoint)"
+                    " + LENGTH(metadata)), 0) FROM checkpoints"
+                ).fetchone()[0]
+                writes = cur.execute(
+                    "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes"
+                ).fetchone()[0]
+            return checkpoints + writes
+
+        # SqliteSaver has no async support; run the sync methods in a thread
+        # so arun_conversation() works with this backend too
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, **kwargs):
+            for item in await asyncio.to_thread(
+                    lambda: list(self.list(config, **kwargs))):
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint,
+                                           metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes,
+                                           task_id, task_path)
+
+        async def adelete_thread(self, thread_id: str):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    return BoundedSqliteSaver()
+
+
+def checkpointer_from_env(serde=None):
+    """Build the graph checkpointer from CHECKPOINT_PATH (SQLite file; in
+    memory if unset), CHECKPOINT_MAX_THREADS, CHECKPOINT_IDLE_TTL and, for
+    SQLite, CHECKPOINT_EVICT_INTERVAL (seconds). Without serde, CHECKPOINT_COMPRESSION and
+    CHECKPOINT_PAYLOAD_BYTES pick the serializer (see checkpoint_serde.py).
+    """
+    path = os.getenv("CHECKPOINT_PATH")
+    idle_ttl = float(os.getenv("CHECKPOINT_IDLE_TTL", 60 * 60))
+    if serde is None:
+        serde = serde_from_env(path, idle_ttl)
+    if path:
+        return bounded_sqlite_saver(
+            path,
+            max_threads=int(os.getenv("CHECKPOINT_MAX_THREADS", 100_000)),
+            idle_ttl=idle_ttl, serde=serde,
+            evict_interval=float(os.getenv("CHECKPOINT_EVICT_INTERVAL", 1)))
+    return BoundedMemorySaver(
+        max_threads=int(os.getenv("CHECKPOINT_MAX_THREADS", 1000)),
+        idle_ttl=idle_ttl, serde=serde)
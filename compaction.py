@@ -0,0 +1,115 @@
+import json
+import math
+import re
+from collections import Counter
+from typing import List
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text with OpenAI tokenizers
+    return math.ceil(len(text) / 4)
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def search_results(messages: List[BaseMessage]) -> List[dict]:
+    """Results of the web searches made for the current question, i.e. the
+    tool messages after the last human message"""
+    results = []
+    for message in reversed(messages):
+        if message.type == "human":
+            break
+        if not isinstance(message, ToolMessage):
+            continue
+        try:
+            response = json.loads(message.content)
+        except (TypeError, ValueError):
+            # Not JSON (e.g. a tool error): keep it as one plain snippet
+            response = {"results": [{"content": str(message.content)}]}
+        if isinstance(response, dict):
+            results.extend(response.get("results", []))
+    return results
+
+
+def _shingles(words: List[str], size: int = 3) -> set:
+    return {tuple(words[i:i + size])
+            for i in range(max(len(words) - size + 1, 1))}
+
+
+def dedupe(results: List[dict], threshold: float = 0.8) -> List[dict]:
+    """Drop results with a URL seen before, or whose content overlaps an
+    earlier result by at least threshold (Jaccard similarity of word
+    3-grams)"""
+    kept, urls, shingle_sets = [], set(), []
+    for result in results:
+        url = result.get("url")
+        if url and url in urls:
+            continue
+        shingles = _shingles(_words(result.get("content", "")))
+        if any(len(shingles & other) / len(shingles | other) >= threshold
+               for other in shingle_sets):
+            continue
+        kept.append(result)
+        shingle_sets.append(shingles)
+        if url:
+            urls.add(url)
+    return kept
+
+
+def rank(results: List[dict], question: str) -> List[dict]:
+    """Order results by BM25 relevance to the question, with the search
+    engine's own score as tie-breaker"""
+    documents = [_words(f"{r.get('title', '')} {r.get('content', '')}")
+                 for r in results]
+    if not documents:
+        return []
+    average_length = sum(map(len, documents)) / len(documents) or 1
+    document_frequency = Counter(w for d in documents for w in set(d))
+    terms = set(_words(question))
+
+    def bm25(words: List[str], k1: float = 1.2, b: float = 0.75) -> float:
+        counts = Counter(words)
+        score = 0.0
+        for term in terms:
+            if not counts[term]:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            tf = counts[term]
+            score += idf * tf * (k1 + 1) / (
+                tf + k1 * (1 - b + b * len(words) / average_length))
+        return score
+
+    scored = [(bm25(words), result.get("score") or 0.0, i)
+              for i, (words, result) in enumerate(zip(documents, results))]
+    scored.sort(key=lambda s: (-s[0], -s[1], s[2]))
+    return [results[i] for _, _, i in scored]
+
+
+def compact(messages: List[BaseMessage], question: str,
+            token_budget: int) -> str:
+    """Parse, de-duplicate and rank the search results for question, and
+    format as many of them as fit into token_budget"""
+    # Of two near-duplicates, the one the search engine scored higher stays
+    results = sorted(search_results(messages),
+                     key=lambda r: -(r.get("score") or 0.0))
+    results = rank(dedupe(results), question)
+    sections, used = [], 0
+    for number, result in enumerate(results, start=1):
+        header = f"[{number}] {result.get('title', '')} " \
+                 f"({result.get('url', 'unknown source')})\n"
+        content = result.get("content", "").strip()
+        remaining = token_budget - used - estimate_tokens(header)
+        if remaining < 50:
+            break
+        if estimate_tokens(content) > remaining:
+            # Cut the last snippet to the budget at a word boundary
+            content = content[:remaining * 4].rsplit(" ", 1)[0] + " ..."
+        section = header + content
+        sections.append(section)
+        used += estimate_tokens(section)
+    return "\n\n".join(sections)
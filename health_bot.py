@@ -1,34 +1,269 @@
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import (SystemMessage, HumanMessage, AIMessage,
+                                     AIMessageChunk, ToolMessage)
 from langchain_core.runnables import RunnableConfig
-from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.tools import StructuredTool
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, MessagesState, START, END, add_messages
-from langgraph.prebuilt import ToolNode
 from langchain_core.messages import AIMessage
-from tavily import TavilyClient
-from typing import Dict, Union
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Union
+from dataclasses import dataclass, replace
+from datetime import datetime
+from pydantic import BaseModel, Field
+from cache import Cache, MISS, normalize_query
+from checkpointing import checkpointer_from_env
+from compaction import compact, estimate_tokens
+from history import fold_history
+from model_profiles import ModelProfile, profiles_from_env
+from response_cache import cache_key, cache_value, cached_output
+import metrics
+import scheduler
+import tracing
+from speculation import Speculator
+from topic_classifier import HEALTH, OFF_TOPIC, classify
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import json
 import os
-import mlflow
+import threading
+import time
 import uuid
 
-# MLFlow setup
-try:
-    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI",
-                                      "http://127.0.0.1:5000"))
-    mlflow.set_experiment("health_bot")
-    mlflow.langchain.autolog()
-except:
-    print("MLflow server not running. Proceeding without MLflow.")
+# The LLM, the compiled graph and MLflow tracing are expensive to set up,
+# so they are built on first use by get_llm() / get_graph(), not on import
+_lazy_lock = threading.Lock()
+_llms = {}  # ModelProfile -> chat model
+_graph = None
+_answer_cache = None
+_source_index = False  # False until built, None when disabled
+_search_client = None
+_async_search_clients = {}  # event loop -> AsyncSearchClient
 
 # base_url = "https://openai.vocareum.com/v1"
-base_url = "https://api.openai.com/v1"
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0.2,
-    base_url=base_url
-)
+# OPENAI_BASE_URL points the bot at another OpenAI-compatible API, e.g. the
+# stand-in of benchmarks/stub_servers.py
+base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+
+# TRACING=mlflow (default) autologs every call to the MLflow server;
+# TRACING=sampled records a share of turns off the request path (see
+# tracing.py); TRACING=off disables both
+tracing_mode = os.getenv("TRACING", "mlflow").lower()
+trace_handler = tracing.handler_from_env()
+
+
+def setup_tracing():
+    if tracing_mode != "mlflow":
+        return
+    # MLFlow setup
+    try:
+        import mlflow
+        mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI",
+                                          "http://127.0.0.1:5000"))
+        mlflow.set_experiment("health_bot")
+        mlflow.langchain.autolog()
+    except Exception:
+        print("MLflow server not running. Proceeding without MLflow.")
+
+
+# Model, temperature, output cap and tool binding per node; see
+# model_profiles.py for the LLM_<NODE>_* settings
+model_profiles = profiles_from_env()
+
+
+def chat_model(profile: ModelProfile):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=profile.model,
+        temperature=profile.temperature,
+        max_tokens=profile.max_tokens,
+        base_url=base_url
+    )
+
+
+def get_llm(node: str = "agent"):
+    """The shared chat model for node, with the web search tool bound only
+    if the node's profile uses tools"""
+    # Profiles that only differ in caching share a client
+    profile = replace(model_profiles[node], cache=False)
+    llm = _llms.get(profile)
+    if llm is None:
+        with _lazy_lock:
+            llm = _llms.get(profile)
+            if llm is None:
+                llm = chat_model(profile)
+                if profile.tools:
+                    llm = llm.bind_tools([web_search])
+                _llms[profile] = llm
+    return llm
+
+
+# Admission control for LLM and search calls: concurrency, rate limits and
+# priorities, see scheduler.py for the SCHEDULER_* settings
+call_scheduler = scheduler.Scheduler.from_env()
+
+
+def _llm_tokens(node: str, messages: list) -> int:
+    # Estimated tokens a call will use: its prompt and its output cap
+    prompt = estimate_tokens("".join(str(m.content) for m in messages))
+    return prompt + (model_profiles[node].max_tokens or 1000)
+
+
+# Exact-match cache of LLM responses for nodes whose profile has cache set;
+# off unless LLM_CACHE_SIZE is set. LLM_CACHE_TTL (seconds) and
+# LLM_CACHE_PATH (SQLite file) as for the search cache
+llm_cache = Cache.from_env("LLM_CACHE", ttl=24 * 60 * 60, max_entries=0)
+
+
+def _llm_cache_key(node: str, messages: list, schema) -> Optional[str]:
+    profile = model_profiles[node]
+    if not (llm_cache.enabled and profile.cache):
+        return None
+    return cache_key(profile, messages, schema)
+
+
+def _llm(node: str, schema=None):
+    if schema is None:
+        return get_llm(node)
+    return get_llm(node).with_structured_output(
+        schema, method="function_calling", include_raw=True)
+
+
+def _used_tokens(output) -> Optional[int]:
+    # Structured output returns the AI message under "raw"
+    message = output["raw"] if isinstance(output, dict) else output
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+def _cached_llm_output(node: str, value: dict, schema=None):
+    output = cached_output(value, schema)
+    # A live call streams its tokens; stream the cached text as one delta,
+    # so that token streams still match the final message
+    if schema is None and isinstance(output.content, str) and output.content:
+        try:
+            writer = get_stream_writer()
+        except RuntimeError:
+            return output  # Not called from a graph node
+        writer(TokenDelta(output.content, node))
+    return output
+
+
+def call_llm(node: str, messages: list, schema=None):
+    """Invoke node's chat model, with structured output if schema is given,
+    once the scheduler admits the call. Repeated calls of cached nodes are
+    answered from llm_cache without an API call."""
+    key = _llm_cache_key(node, messages, schema)
+    if key is not None:
+        value = llm_cache.get(key)
+        if value is not MISS:
+            return _cached_llm_output(node, value, schema)
+
+    started = time.perf_counter()
+    with call_scheduler.admit("llm", node,
+                              _llm_tokens(node, messages)) as admission:
+        output = _llm(node, schema).invoke(messages)
+        admission.used(_used_tokens(output))
+    if key is not None and (value := cache_value(output)) is not None:
+        llm_cache.set(key, value, cost=time.perf_counter() - started)
+    return output
+
+
+async def acall_llm(node: str, messages: list, schema=None):
+    key = _llm_cache_key(node, messages, schema)
+    if key is not None:
+        value = llm_cache.get(key)
+        if value is not MISS:
+            return _cached_llm_output(node, value, schema)
+
+    started = time.perf_counter()
+    async with call_scheduler.aadmit("llm", node,
+                                     _llm_tokens(node, messages)) as admission:
+        output = await _llm(node, schema).ainvoke(messages)
+        admission.used(_used_tokens(output))
+    if key is not None and (value := cache_value(output)) is not None:
+        llm_cache.set(key, value, cost=time.perf_counter() - started)
+    return output
+
+
+def get_answer_cache():
+    global _answer_cache
+    if _answer_cache is None:
+        with _lazy_lock:
+            if _answer_cache is None:
+                from answer_cache import AnswerCache
+                _answer_cache = AnswerCache.from_env()
+    return _answer_cache
+
+
+def get_source_index():
+    """The local index of fetched sources, or None without
+    SOURCE_INDEX_PATH"""
+    global _source_index
+    if _source_index is False:
+        with _lazy_lock:
+            if _source_index is False:
+                from source_index import SourceIndex
+                _source_index = SourceIndex.from_env()
+    return _source_index
+
+
+def get_search_client():
+    """The process-wide pooled search client"""
+    global _search_client
+    if _search_client is None:
+        with _lazy_lock:
+            if _search_client is None:
+                from search_client import SearchClient, client_settings
+                _search_client = SearchClient(**client_settings())
+    return _search_client
+
+
+def get_async_search_client():
+    """The pooled async search client of the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_search_clients.get(loop)
+    if client is None:
+        from search_client import AsyncSearchClient, client_settings
+        client = _async_search_clients[loop] = AsyncSearchClient(
+            **client_settings())
+        # Forget clients of closed loops
+        for other in [l for l in _async_search_clients if l.is_closed()]:
+            del _async_search_clients[other]
+    return client
+
+
+# Search results cache, keyed on the normalized query. Configure with
+# SEARCH_CACHE_TTL (seconds), SEARCH_CACHE_SIZE (entries, 0 disables) and
+# SEARCH_CACHE_PATH (SQLite file shared by all worker processes)
+search_cache = Cache.from_env("SEARCH_CACHE", ttl=6 * 60 * 60,
+                              max_entries=512, key_fn=normalize_query)
+
+# With SPECULATIVE_QUIZ=true the quiz question is generated in the background
+# while the user decides whether they want a quiz
+speculative_quiz = os.getenv("SPECULATIVE_QUIZ", "False").lower() == "true"
+quiz_speculator = Speculator()
+
+# With DIRECT_SEARCH=true, questions a local keyword classifier recognises
+# as health questions are searched directly and clearly off-topic ones are
+# refused, without the agent LLM call; only ambiguous ones reach the agent
+direct_search_enabled = os.getenv("DIRECT_SEARCH", "False").lower() == "true"
+
+# With FUSED_SUMMARY=true one structured-output call writes the summary, the
+# quiz question and an answer key: generate_quiz then needs no LLM call and
+# grade_quiz sends the answer key instead of the whole summary. It costs more
+# tokens when the quiz is declined and the summary is not streamed, so it is
+# off by default
+fused_summary = os.getenv("FUSED_SUMMARY", "False").lower() == "true"
+
+# With HISTORY_WINDOW=<n> a new topic continues on the same thread instead of
+# a new one. Only the last n messages are kept: older ones are folded into a
+# rolling summary of at most HISTORY_SUMMARY_CHARS characters in the system
+# prompt, and search results are replaced by stubs once summarized
+history_window = int(os.getenv("HISTORY_WINDOW", 0))
+history_summary_chars = int(os.getenv("HISTORY_SUMMARY_CHARS", 1500))
 
 
 @dataclass
@@ -40,6 +275,28 @@ class UserInputRequest:
     options: list = None  # For multiple choice questions
 
 
+class ConversationConflict(ValueError):
+    """Raised by HealthBotSession.step() when another reply to the same
+    conversation is already being handled"""
+
+
+# Longest a step() holds its conversation; the lease of a worker that died
+# mid-step expires after this
+STEP_LEASE_SECONDS = 10 * 60
+
+# A conversation counts as active in the sessions_active metric while its
+# last checkpoint is at most this old
+ACTIVE_SESSION_SECONDS = 5 * 60
+
+
+@dataclass
+class TokenDelta:
+    """A fragment of an AI message that is still being generated. The
+    complete message is yielded as a str once it is finished."""
+    content: str
+    node: str
+
+
 class State(MessagesState):
     user_question: str
     summary: str
@@ -47,27 +304,111 @@ class State(MessagesState):
     quiz_answer: str
     quiz_choice: str
     new_topic_choice: str
+    answer_cache_hit: bool
+    context: str
+    answer_key: str  # Only set by the fused summary
+    history_summary: str  # Earlier topics, with HISTORY_WINDOW
+
+
+SYSTEM_PROMPT = (
+    "You are a health bot. You are a helpful and reliable assistant"
+    " that answers questions about health."
+    "You prefer to use web search to find information. When receiving "
+    "a question, use web search to find top web search results"
+    "For broad questions, search for up to 4 focused sub-questions at "
+    "once instead of one general query. "
+    "You do not accept questions about anything else than health"
+)
 
+# Everything a topic leaves behind, reset when the next one starts
+TOPIC_STATE = {"summary": "", "comprehension_question": "", "quiz_answer": "",
+               "quiz_choice": "", "new_topic_choice": "", "context": "",
+               "answer_key": "", "answer_cache_hit": False}
 
-def entry_point(state: State):
-    # Starting node
-    system_message = SystemMessage(
-        "You are a health bot. You are a helpful and reliable assistant"
-        " that answers questions about health."
-        "You prefer to use web search to find information. When receiving "
-        "a question, use web search to find top web search results"
-        "You do not accept questions about anything else than health"
-    )
 
+def entry_point(state: State):
+    # Starting node. The system message has a fixed id, so a later topic on
+    # the same thread replaces it instead of adding another one.
+    system_message = SystemMessage(SYSTEM_PROMPT, id="system")
     human_message = HumanMessage(state["user_question"])
-    messages = add_messages(system_message, human_message)
-
-    return {"messages": messages}
+    if not (history_window and state.get("messages")):
+        messages = add_messages(system_message, human_message)
+        return {"messages": messages, **TOPIC_STATE}
+
+    # A new topic on a thread with history: trim it to the window
+    updates, history_summary = fold_history(
+        state["messages"], history_window, state.get("history_summary", ""),
+        history_summary_chars, boilerplate=(CONGRATULATION,))
+    if history_summary:
+        system_message.content += (
+            f"\n\nEarlier in this conversation:\n{history_summary}")
+    return {"messages": [system_message, *updates, human_message],
+            "history_summary": history_summary, **TOPIC_STATE}
+
+
+def follows_up(state: State) -> bool:
+    # Whether earlier topics on the thread may give the question its
+    # meaning ("and for children?"), so it must not be taken on its own
+    return bool(state.get("history_summary")) or \
+        sum(m.type == "human" for m in state["messages"]) > 1
+
+
+def check_answer_cache(state: State):
+    # Reuse the summary of a sufficiently similar earlier question. The cache
+    # is disabled unless ANSWER_CACHE_SIZE is set; follow-up questions are
+    # neither looked up nor stored.
+    if follows_up(state):
+        return {"answer_cache_hit": False}
+    cached = get_answer_cache().lookup(state["user_question"])
+    if cached is None:
+        return {"answer_cache_hit": False}
+
+    return {"messages": [AIMessage(content=cached.summary)],
+            "summary": cached.summary,
+            "comprehension_question": "",
+            "answer_key": "",
+            "answer_cache_hit": True}
+
+
+def route_from_answer_cache(state: State):
+    # Cached answers continue straight at the quiz question
+    if state.get("answer_cache_hit"):
+        return "ask_for_quiz"
+    # A follow-up is left to the agent, which sees the earlier topics
+    if direct_search_enabled and not follows_up(state):
+        topic = classify(state["user_question"])
+        if topic == HEALTH:
+            return "direct_search"
+        if topic == OFF_TOPIC:
+            return "refuse_question"
+    return "agent"
+
+
+def direct_search(state: State):
+    # Stands in for the agent: the same tool call it would make, searching
+    # for the question as asked
+    tool_call = {"name": "web_search",
+                 "args": {"query": state["user_question"]},
+                 "id": f"direct_{uuid.uuid4().hex[:12]}"}
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+
+REFUSAL = ("I can only help with questions about health. Please ask me "
+           "about a health topic.")
+
+
+def refuse_question(state: State):
+    return {"messages": [AIMessage(content=REFUSAL)]}
 
 
 def agent(state: State):
     # Research agent
-    ai_message = llm.invoke(state["messages"])
+    ai_message = call_llm("agent", state["messages"])
+    return {"messages": [ai_message]}
+
+
+async def aagent(state: State):
+    ai_message = await acall_llm("agent", state["messages"])
     return {"messages": [ai_message]}
 
 
@@ -81,17 +422,142 @@ def route_to_tool(state: State):
         return END
 
 
-@tool
-def web_search(query: str) -> Dict:
+def search(query: str) -> Dict:
     """
      Return top web search results for a given search query
      """
-    tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
-    response = tavily_client.search(query)
+    response = search_cache.get(query)
+    if response is not MISS:
+        return response
+
+    index = get_source_index()
+    if index is not None:
+        response = index.lookup(query)
+        if response is not None:
+            return response
+
+    started = time.perf_counter()
+    with call_scheduler.admit("search", "web_search"):
+        response = get_search_client().search(query)
+    search_cache.set(query, response, cost=time.perf_counter() - started)
+    if index is not None:
+        index.add(response)
     return response
 
 
-def summarize(state: State):
+async def asearch(query: str) -> Dict:
+    """
+     Return top web search results for a given search query
+     """
+    # The cache's SQLite tier and the index's memory-mapped segments may
+    # read the disk, so they are not touched on the event loop
+    response = await asyncio.to_thread(search_cache.get, query)
+    if response is not MISS:
+        return response
+
+    index = get_source_index()
+    if index is not None:
+        response = await asyncio.to_thread(index.lookup, query)
+        if response is not None:
+            return response
+
+    started = time.perf_counter()
+    async with call_scheduler.aadmit("search", "web_search"):
+        response = await get_async_search_client().search(query)
+    await asyncio.to_thread(search_cache.set, query, response,
+                            cost=time.perf_counter() - started)
+    if index is not None:
+        index.add(response)  # Only buffers; a background thread writes
+    return response
+
+
+# The tool runs search() under graph.stream and asearch() under graph.astream
+web_search = StructuredTool.from_function(func=search, coroutine=asearch,
+                                          name="web_search")
+
+# Upper bound on searches running at once, per process (sync) or per
+# question (async)
+search_concurrency = int(os.getenv("SEARCH_CONCURRENCY", 4))
+search_pool = ThreadPoolExecutor(max_workers=search_concurrency,
+                                 thread_name_prefix="web_search")
+
+
+def _url_key(url: str) -> str:
+    return url.split("#")[0].rstrip("/").lower()
+
+
+def search_tool_messages(tool_calls: list, responses: list) -> list:
+    """One ToolMessage per tool call. Results whose URL was already returned
+    for an earlier call are dropped, so summarize sees each source once."""
+    seen_urls = set()
+    messages = []
+    for tool_call, response in zip(tool_calls, responses):
+        if isinstance(response, Exception):
+            messages.append(ToolMessage(
+                content=f"Error: {response!r}", name=tool_call["name"],
+                tool_call_id=tool_call["id"], status="error"))
+            continue
+        results = []
+        for result in response.get("results", []):
+            key = _url_key(result.get("url", ""))
+            if key and key in seen_urls:
+                continue
+            seen_urls.add(key)
+            results.append(result)
+        messages.append(ToolMessage(
+            content=json.dumps({**response, "results": results},
+                               ensure_ascii=False),
+            name=tool_call["name"], tool_call_id=tool_call["id"]))
+    return messages
+
+
+def _search_or_error(tool_call: dict):
+    try:
+        if tool_call["name"] != "web_search":
+            raise ValueError(f"Unknown tool {tool_call['name']}")
+        return search(**tool_call["args"])
+    except Exception as error:
+        return error
+
+
+def run_searches(state: State):
+    # Run all web_search calls of the agent at once and merge their results
+    tool_calls = state["messages"][-1].tool_calls
+    if len(tool_calls) == 1:
+        responses = [_search_or_error(tool_calls[0])]
+    else:
+        futures = [search_pool.submit(contextvars.copy_context().run,
+                                      _search_or_error, tool_call)
+                   for tool_call in tool_calls]
+        responses = [future.result() for future in futures]
+    return {"messages": search_tool_messages(tool_calls, responses)}
+
+
+async def arun_searches(state: State):
+    tool_calls = state["messages"][-1].tool_calls
+    semaphore = asyncio.Semaphore(search_concurrency)
+
+    async def run(tool_call: dict):
+        async with semaphore:
+            if tool_call["name"] != "web_search":
+                raise ValueError(f"Unknown tool {tool_call['name']}")
+            return await asearch(**tool_call["args"])
+
+    responses = await asyncio.gather(*map(run, tool_calls),
+                                     return_exceptions=True)
+    return {"messages": search_tool_messages(tool_calls, responses)}
+
+
+def compact_context(state: State):
+    # Keep only the de-duplicated search snippets most relevant to the
+    # question, within CONTEXT_TOKEN_BUDGET; later nodes never see the raw
+    # search responses
+    context = compact(state["messages"], state["user_question"],
+                      int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500)))
+    return {"context": context}
+
+
+def summarize_messages(state: State, fused: bool = False) -> list:
     # Summarize web search
     system_message = SystemMessage(
         "Summarize the search results from the web search tool into a "
@@ -99,9 +565,72 @@ def summarize(state: State):
         "helpful response, spanning 2-3 paragraphs."
         "Make sure to use at least 3 sources."
         "Cite your sources."
+        + (" Then write a comprehension question about your summary and "
+           "an answer key for grading it." if fused else "")
     )
-    ai_message = llm.invoke(state["messages"] + [system_message])
-    return {"messages": [ai_message], "summary": ai_message.content}
+    human_message = HumanMessage(
+        f"Question: {state['user_question']}\n\n"
+        f"Search results:\n\n{state['context']}"
+    )
+    return [system_message, human_message]
+
+
+class SummaryWithQuiz(BaseModel):
+    """Summary of the search results and a comprehension quiz about it"""
+    summary: str = Field(description=(
+        "Coherent, helpful answer to the question spanning 2-3 paragraphs, "
+        "using at least 3 sources and citing them"))
+    question: str = Field(description=(
+        "One single-sentence comprehension question about the summary, "
+        "without answer options, for a free text answer"))
+    answer_key: str = Field(description=(
+        "Compact answer key for grading: the expected answer and the "
+        "sentence of the summary that supports it"))
+
+
+def summarized(state: State, ai_message: AIMessage) -> dict:
+    if not follows_up(state):
+        get_answer_cache().add(state["user_question"], ai_message.content)
+    # Clears the quiz of an earlier fused summary
+    return {"messages": [ai_message], "summary": ai_message.content,
+            "comprehension_question": "", "answer_key": ""}
+
+
+def fused_summarized(state: State, output: dict) -> Optional[dict]:
+    """State update from a fused summary, or None if the model's output did
+    not parse"""
+    parsed = output["parsed"]
+    if parsed is None:
+        return None
+    ai_message = AIMessage(content=parsed.summary,
+                           usage_metadata=output["raw"].usage_metadata)
+    if not follows_up(state):
+        get_answer_cache().add(state["user_question"], parsed.summary)
+    return {"messages": [ai_message], "summary": parsed.summary,
+            "comprehension_question": parsed.question,
+            "answer_key": parsed.answer_key}
+
+
+def summarize(state: State):
+    if fused_summary:
+        update = fused_summarized(state, call_llm(
+            "summarize_quiz", summarize_messages(state, fused=True),
+            SummaryWithQuiz))
+        if update:
+            return update
+    return summarized(state, call_llm("summarize",
+                                      summarize_messages(state)))
+
+
+async def asummarize(state: State):
+    if fused_summary:
+        update = fused_summarized(state, await acall_llm(
+            "summarize_quiz", summarize_messages(state, fused=True),
+            SummaryWithQuiz))
+        if update:
+            return update
+    return summarized(state, await acall_llm("summarize",
+                                            summarize_messages(state)))
 
 
 def ask_for_quiz(state: State):
@@ -146,7 +675,7 @@ def ask_topic_question(state: State):
     return state
 
 
-def generate_quiz(state: State):
+def quiz_messages(state: State) -> list:
     system_message = SystemMessage(
         "Generate a comprehension quiz based on the summary from the web "
         "search tool."
@@ -156,13 +685,90 @@ def generate_quiz(state: State):
         f'Use only this information as source for your question: '
         f'{state["summary"]}'
     )
-    ai_message = llm.invoke(state["messages"] + [system_message])
+    # The summary is all the quiz needs, not the conversation so far
+    return [system_message]
+
+
+def speculative_quiz_call(state: State) -> AIMessage:
+    # Run by quiz_speculator, so it yields to every call a user is actually
+    # waiting for until generate_quiz claims it
+    return call_llm("generate_quiz", quiz_messages(state))
+
+
+def quiz_speculation_key(thread_id: str, summary: str) -> str:
+    # Includes the summary, so a speculative question for another summary
+    # is never used
+    return f"{thread_id}:{hashlib.sha1(summary.encode()).hexdigest()}"
+
+
+def speculates_quiz(next_node: str, values: dict) -> bool:
+    # Whether the quiz question is generated while the user is asked
+    # next_node; a fused summary has written it already
+    return speculative_quiz and next_node == "ask_for_quiz" and \
+        not values.get("answer_key")
+
+
+def prepared_quiz(state: State) -> Optional[dict]:
+    # The question written together with a fused summary
+    if not state.get("answer_key"):
+        return None
+    return {"messages": [AIMessage(content=state["comprehension_question"])],
+            "comprehension_question": state["comprehension_question"]}
+
+
+def generate_quiz(state: State, config: RunnableConfig):
+    if prepared := prepared_quiz(state):
+        return prepared
+    ai_message = None
+    future = quiz_speculator.claim(quiz_speculation_key(
+        config["configurable"]["thread_id"], state["summary"]))
+    if future is not None and not future.cancelled():
+        try:
+            ai_message = future.result()
+        except Exception:
+            pass  # Speculation failed, generate the question now
+    if ai_message is None:
+        ai_message = call_llm("generate_quiz", quiz_messages(state))
 
     return {"messages": [ai_message],
             "comprehension_question": ai_message.content}
 
 
-def grade_quiz(state: State):
+async def agenerate_quiz(state: State, config: RunnableConfig):
+    if prepared := prepared_quiz(state):
+        return prepared
+    ai_message = None
+    future = quiz_speculator.claim(quiz_speculation_key(
+        config["configurable"]["thread_id"], state["summary"]))
+    if future is not None and not future.cancelled():
+        try:
+            ai_message = await asyncio.wrap_future(future)
+        except Exception:
+            pass
+    if ai_message is None:
+        ai_message = await acall_llm("generate_quiz", quiz_messages(state))
+
+    return {"messages": [ai_message],
+            "comprehension_question": ai_message.content}
+
+
+# Prepended to every grade
+CONGRATULATION = "🎉 Well done! Here's how I grade your answer and an explanation:\n\n"
+
+
+def grading_messages(state: State) -> list:
+    if state.get("answer_key"):
+        # The answer key stands in for the summary
+        return [SystemMessage(
+            "You are grading a comprehension quiz about health. "
+            "Don't grade too hard - accept short answers from the user. "
+            f"The question was: {state['comprehension_question']} "
+            f"The answer key is: {state['answer_key']} "
+            f"The user's answer is: {state['quiz_answer']} "
+            "Grade the user's answer with a grade from A (best) to F "
+            "(failed). Provide a short explanation for your grade, citing "
+            "the answer key."
+        )]
     system_message = SystemMessage(
         "You are grading a comprehension quiz about health"
         "Don't grade too hard - accept short answers from the user"
@@ -176,91 +782,184 @@ def grade_quiz(state: State):
     )
 
     # Don't need the full message history here as we're only grading
-    ai_message = llm.invoke([system_message])
-    
+    return [system_message]
+
+
+def graded(ai_message: AIMessage):
     # Modify the message content by adding the congratulatory line at the start
-    modified_content = f"🎉 Well done! Here's how I grade your answer and an explanation:\n\n{ai_message.content}"
+    modified_content = f"{CONGRATULATION}{ai_message.content}"
     
-    # Create a new message with the modified content
-    modified_message = AIMessage(content=modified_content)
+    # Create a new message with the modified content, keeping token usage
+    # for the metrics
+    modified_message = AIMessage(content=modified_content,
+                                 usage_metadata=ai_message.usage_metadata)
 
     return {"messages": [modified_message]}
 
 
-# bind tools
-llm = llm.bind_tools([web_search])
-
-# build graph
-workflow = StateGraph(State)
-workflow.add_node("entry_point", entry_point)
-workflow.add_node("agent", agent)
-workflow.add_node("web_search", ToolNode([web_search]))
-workflow.add_node("summarize", summarize)
-workflow.add_node("generate_quiz", generate_quiz)
-workflow.add_node("grade_quiz", grade_quiz)
-workflow.add_node("ask_for_quiz", ask_for_quiz)
-workflow.add_node("ask_for_new_topic", ask_for_new_topic)
-workflow.add_node("ask_topic_question", ask_topic_question)
-workflow.add_node("goodbye_message", goodbye_message)
-
-# Start
-workflow.add_edge(START, "entry_point")
-workflow.add_edge("entry_point", "agent")
-
-# Routes to web search tool
-workflow.add_conditional_edges(
-    source="agent",
-    path=route_to_tool,
-    path_map=["web_search", END]
-)
+def grade_quiz(state: State):
+    # Streamed ahead of the grade, so that token streams match the final text
+    get_stream_writer()(TokenDelta(CONGRATULATION, "grade_quiz"))
+    return graded(call_llm("grade_quiz", grading_messages(state)))
+
+
+async def agrade_quiz(state: State):
+    get_stream_writer()(TokenDelta(CONGRATULATION, "grade_quiz"))
+    return graded(await acall_llm("grade_quiz", grading_messages(state)))
+
+
+def build_graph(checkpointer=None):
+    """Build and compile the workflow"""
+    # build graph
+    workflow = StateGraph(State)
+    # Every node records its latency, errors and token usage in metrics
+    def add_node(name, func, afunc=None):
+        workflow.add_node(name, metrics.instrument(name, func, afunc))
+
+    add_node("entry_point", entry_point)
+    add_node("check_answer_cache", check_answer_cache)
+    add_node("agent", agent, aagent)
+    add_node("direct_search", direct_search)
+    add_node("refuse_question", refuse_question)
+    add_node("web_search", run_searches, arun_searches)
+    add_node("compact_context", compact_context)
+    add_node("summarize", summarize, asummarize)
+    add_node("generate_quiz", generate_quiz, agenerate_quiz)
+    add_node("grade_quiz", grade_quiz, agrade_quiz)
+    add_node("ask_for_quiz", ask_for_quiz)
+    add_node("ask_for_new_topic", ask_for_new_topic)
+    add_node("ask_topic_question", ask_topic_question)
+    add_node("goodbye_message", goodbye_message)
+
+    # Start
+    workflow.add_edge(START, "entry_point")
+    workflow.add_edge("entry_point", "check_answer_cache")
+
+    # Cache hits skip research and summarization
+    workflow.add_conditional_edges(
+        source="check_answer_cache",
+        path=route_from_answer_cache,
+        path_map=["agent", "direct_search", "refuse_question",
+                  "ask_for_quiz"]
+    )
+    workflow.add_edge("direct_search", "web_search")
+    workflow.add_edge("refuse_question", END)
 
-workflow.add_edge("web_search", "summarize")
+    # Routes to web search tool
+    workflow.add_conditional_edges(
+        source="agent",
+        path=route_to_tool,
+        path_map=["web_search", END]
+    )
 
-# At this point, we interrupt and ask if they want a quiz
-workflow.add_edge("summarize", "ask_for_quiz")
+    workflow.add_edge("web_search", "compact_context")
+    workflow.add_edge("compact_context", "summarize")
 
-# Check if they wanted a quiz and route
-workflow.add_conditional_edges(
-    source="ask_for_quiz",
-    path=route_to_quiz,
-    path_map={
-        "generate_quiz": "generate_quiz",
-        "ask_for_new_topic": "ask_for_new_topic"
-    }
-)
+    # At this point, we interrupt and ask if they want a quiz
+    workflow.add_edge("summarize", "ask_for_quiz")
 
-workflow.add_edge("generate_quiz", "grade_quiz")
+    # Check if they wanted a quiz and route
+    workflow.add_conditional_edges(
+        source="ask_for_quiz",
+        path=route_to_quiz,
+        path_map={
+            "generate_quiz": "generate_quiz",
+            "ask_for_new_topic": "ask_for_new_topic"
+        }
+    )
 
-# At this point, we interrupt and ask if they want a new topic
-workflow.add_edge("grade_quiz", "ask_for_new_topic")
+    workflow.add_edge("generate_quiz", "grade_quiz")
 
-# Route based on new topic choice
-workflow.add_conditional_edges(
-    source="ask_for_new_topic",
-    path=route_to_new_topic,
-    path_map={
-        "ask_topic_question": "ask_topic_question",
-        "goodbye_message": "goodbye_message"
-    }
-)
+    # At this point, we interrupt and ask if they want a new topic
+    workflow.add_edge("grade_quiz", "ask_for_new_topic")
 
-# Loop back to entry_point with new question
-workflow.add_edge("ask_topic_question", "entry_point")
+    # Route based on new topic choice
+    workflow.add_conditional_edges(
+        source="ask_for_new_topic",
+        path=route_to_new_topic,
+        path_map={
+            "ask_topic_question": "ask_topic_question",
+            "goodbye_message": "goodbye_message"
+        }
+    )
 
-# Add edge from goodbye to END:
-workflow.add_edge("goodbye_message", END)
+    # Loop back to entry_point with new question
+    workflow.add_edge("ask_topic_question", "entry_point")
 
-memory = MemorySaver()
-graph = workflow.compile(
-    interrupt_before=["ask_for_quiz", "ask_for_new_topic", "grade_quiz",
-                      "ask_topic_question"],
-    checkpointer=memory
-)
+    # Add edge from goodbye to END:
+    workflow.add_edge("goodbye_message", END)
+
+    # Idle threads are evicted; checkpointer.metrics() reports live threads
+    # and bytes held
+    return workflow.compile(
+        interrupt_before=["ask_for_quiz", "ask_for_new_topic", "grade_quiz",
+                          "ask_topic_question"],
+        checkpointer=checkpointer or checkpointer_from_env()
+    )
 
-# Draw the graph for inspection/debugging
-png_bytes = graph.get_graph().draw_mermaid_png()
-with open("health_bot_workflow.png", "wb") as f:
-    f.write(png_bytes)
+
+def get_graph():
+    """The shared compiled graph, built (with tracing set up) on first use"""
+    global _graph
+    if _graph is None:
+        with _lazy_lock:
+            if _graph is None:
+                setup_tracing()
+                _graph = build_graph()
+                register_collectors(_graph)
+                if os.getenv("METRICS_PORT"):
+                    metrics.serve(int(os.getenv("METRICS_PORT")))
+    return _graph
+
+
+def register_collectors(graph):
+    # Cache, client and checkpointer counters, read when metrics are scraped
+    metrics.registry.collector("search_cache", search_cache.report)
+    metrics.registry.collector("llm_cache", llm_cache.report)
+    metrics.registry.collector(
+        "answer_cache",
+        lambda: _answer_cache.report() if _answer_cache else {})
+    metrics.registry.collector(
+        "search_client",
+        lambda: _search_client.report() if _search_client else {})
+    metrics.registry.collector(
+        "source_index",
+        lambda: _source_index.report() if _source_index else {})
+    metrics.registry.collector("quiz_speculation", quiz_speculator.report)
+    metrics.registry.collector("scheduler", call_scheduler.report)
+    if trace_handler is not None:
+        metrics.registry.collector("tracing", trace_handler.report)
+    if hasattr(graph.checkpointer, "metrics"):
+        metrics.registry.collector("checkpointer",
+                                   graph.checkpointer.metrics)
+        # Counted from the checkpointer rather than in the session code, so
+        # abandoned conversations drop out and every server worker sharing
+        # a SQLite file reports the same number
+        metrics.registry.collector("sessions", lambda: {
+            "active": graph.checkpointer.active_threads(
+                ACTIVE_SESSION_SECONDS)})
+
+
+def draw_graph(path: str = "health_bot_workflow.png"):
+    """Render the graph for inspection/debugging. Uses the remote mermaid.ink
+    renderer, so it needs network access."""
+    png_bytes = get_graph().get_graph().draw_mermaid_png()
+    with open(path, "wb") as f:
+        f.write(png_bytes)
+
+
+def __getattr__(name: str):
+    # Keep health_bot.graph, .llm etc. working without building them at
+    # import time
+    if name == "graph":
+        return get_graph()
+    if name == "llm":
+        return get_llm()
+    if name == "memory":
+        return get_graph().checkpointer
+    if name == "answer_cache":
+        return get_answer_cache()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class HealthBotSession:
@@ -269,30 +968,197 @@ class HealthBotSession:
     The graph manages the flow, we just translate states to UI actions.
     """
 
-    def __init__(self, initial_question: str):
+    def __init__(self, initial_question: str, stream_tokens: bool = False):
         self.thread_id = str(uuid.uuid4())
         self.config = RunnableConfig()
         self.config["configurable"] = {"thread_id": self.thread_id}
+        if trace_handler is not None:
+            self.config["callbacks"] = [trace_handler]
         self.last_printed_message_id = None
         self.initial_question = initial_question
+        self.stream_tokens = stream_tokens
+        self.quiz_speculation = None  # Key of the pending speculative quiz
+
+    @classmethod
+    def resume(cls, thread_id: str) -> "HealthBotSession":
+        """A session continuing the conversation stored under thread_id"""
+        session = cls(initial_question="")
+        session.thread_id = thread_id
+        session.config["configurable"]["thread_id"] = thread_id
+        return session
+
+    def pending_request(self) -> Optional[UserInputRequest]:
+        """The question the conversation is waiting on, if any"""
+        state = get_graph().get_state(self.config)
+        return self._input_request(state.next[0]) if state.next else None
+
+    def step(self, user_response: str = None) -> tuple:
+        """Run the conversation up to the next question for the user.
+
+        Unlike run_conversation(), nothing is kept in memory between calls:
+        progress is read from and written to the checkpointer under
+        thread_id, so any process sharing the checkpointer can serve the
+        next call. Without user_response the conversation starts with
+        initial_question. Returns the new AI messages and the next
+        UserInputRequest, or None once the conversation is over. A new
+        topic moves the conversation to a new thread_id, unless
+        HISTORY_WINDOW is set. Raises ConversationConflict while another
+        step() on the same conversation is running, in any process.
+        """
+        graph = get_graph()
+        lease = getattr(graph.checkpointer, "lease", None)
+        if user_response is None or lease is None:
+            return self._step(graph, user_response)
+        thread_id = self.thread_id
+        token = lease(thread_id, STEP_LEASE_SECONDS)
+        if token is None:
+            raise ConversationConflict(
+                f"Conversation {thread_id} is already handling a reply")
+        try:
+            return self._step(graph, user_response)
+        finally:
+            graph.checkpointer.release(thread_id, token)
+
+    def _step(self, graph, user_response: Optional[str]) -> tuple:
+        seen = set()
+        if user_response is None:
+            input_data = {"user_question": self.initial_question}
+        else:
+            state = graph.get_state(self.config)
+            if not state.next:
+                raise ValueError(
+                    f"Conversation {self.thread_id} is not waiting for input")
+            next_node = state.next[0]
+            if state.created_at:
+                # The prompt was asked when its checkpoint was written
+                asked = datetime.fromisoformat(state.created_at).timestamp()
+                metrics.interrupt_wait.observe(
+                    max(time.time() - asked, 0.0),
+                    input_type=self._input_request(next_node).input_type)
+            if speculates_quiz(next_node, state.values):
+                self.quiz_speculation = quiz_speculation_key(
+                    self.thread_id, state.values["summary"])
+            update, input_data, old_thread_id = self._handle_response(
+                next_node, user_response)
+            if old_thread_id:
+                graph.checkpointer.delete_thread(old_thread_id)
+            if update:
+                graph.update_state(self.config, update)
+                seen = {message.id for message in state.values["messages"]}
+
+        graph.invoke(input_data, self.config)
+        state = graph.get_state(self.config)
+        messages = [message.content
+                    for message in state.values.get("messages", [])
+                    if message.id not in seen and message.type == "ai"
+                    and message.content]
+        if not state.next:
+            return messages, None
+        self._speculate(state.next[0], state.values)
+        return messages, self._input_request(state.next[0])
+
+    def _stream_mode(self) -> list:
+        if self.stream_tokens:
+            return ["values", "messages", "custom"]
+        return ["values"]
+
+    def _outputs(self, mode: str, event):
+        """Translate one graph stream event into the items the session
+        yields: TokenDeltas and finished AI messages"""
+        if mode == "messages":
+            chunk, metadata = event
+            if isinstance(chunk, AIMessageChunk) and chunk.content:
+                yield TokenDelta(chunk.content, metadata["langgraph_node"])
+        elif mode == "custom":
+            yield event  # TokenDelta written by a node
+        elif messages := event.get("messages", []):
+            message = messages[-1]
+            if (message.id != self.last_printed_message_id and
+                    message.type == "ai" and
+                    message.content):
+                self.last_printed_message_id = message.id
+                yield message.content  # Yield AI message
+
+    @staticmethod
+    def _input_request(next_node: str) -> UserInputRequest:
+        """The question to ask the user before the graph can run next_node"""
+        if next_node == "ask_for_quiz":
+            return UserInputRequest(
+                prompt="Would you like to do a quiz about this topic?",
+                input_type="quiz_choice",
+                options=["Yes", "No"]
+            )
+        elif next_node == "grade_quiz":
+            return UserInputRequest(
+                prompt="Please state your answer:",
+                input_type="quiz_answer"
+            )
+        elif next_node == "ask_for_new_topic":
+            return UserInputRequest(
+                prompt="Would you like to discuss another topic?",
+                input_type="new_topic_choice",
+                options=["Yes", "No"]
+            )
+        elif next_node == "ask_topic_question":
+            return UserInputRequest(
+                prompt="What health topic would you like me to research?",
+                input_type="new_question"
+            )
+
+    def _speculate(self, next_node: str, values: dict):
+        """Start generating the quiz question while the user decides whether
+        they want a quiz"""
+        if speculates_quiz(next_node, values):
+            self.quiz_speculation = quiz_speculation_key(self.thread_id,
+                                                         values["summary"])
+            quiz_speculator.start(self.quiz_speculation,
+                                  lambda: speculative_quiz_call(values))
+
+    def _handle_response(self, next_node: str, user_response: str):
+        """Translate the user's response into a state update for the current
+        thread, the input for the next graph run and a thread the caller
+        should delete, if any"""
+        if next_node == "ask_topic_question":
+            self.initial_question = user_response
+            if history_window:
+                # Resumes at ask_topic_question, which leads to entry_point;
+                # entry_point trims the history and resets the topic state
+                return {"user_question": user_response}, None, None
+
+            # For new questions, we reset and restart with new input on a
+            # fresh thread; the old one is never resumed
+            self.last_printed_message_id = None
+            old_thread_id = self.thread_id
+            self.thread_id = str(uuid.uuid4())
+            self.config["configurable"]["thread_id"] = self.thread_id
+            return None, {"user_question": user_response}, old_thread_id
+
+        if next_node == "grade_quiz":
+            return {"quiz_answer": user_response}, None, None
+
+        choice = "yes" if user_response.lower().strip() in ["y", "yes"] \
+            else "no"
+        if next_node == "ask_for_quiz":
+            if choice == "no" and self.quiz_speculation:
+                quiz_speculator.discard(self.quiz_speculation)
+            return {"quiz_choice": choice}, None, None
+        # No new input data needed, just continue
+        return {"new_topic_choice": choice}, None, None
 
     def run_conversation(self):
         """Generator that yields AI messages and UserInputRequests, expects
-        user responses via send()"""
+        user responses via send(). With stream_tokens, each AI message is
+        preceded by the TokenDeltas it was generated from."""
 
         input_data = {"user_question": self.initial_question}
 
         while True:
             # Stream the graph until it stops (interrupt or end)
-            for event in graph.stream(input=input_data, config=self.config,
-                                      stream_mode="values"):
-                if messages := event.get("messages", []):
-                    message = messages[-1]
-                    if (message.id != self.last_printed_message_id and
-                            message.type == "ai" and
-                            message.content):
-                        self.last_printed_message_id = message.id
-                        yield message.content  # Yield AI message
+            graph = get_graph()
+            for mode, event in graph.stream(
+                    input=input_data, config=self.config,
+                    stream_mode=self._stream_mode()):
+                yield from self._outputs(mode, event)
 
             # Check what's next after streaming stops
             state = graph.get_state(self.config)
@@ -301,48 +1167,63 @@ class HealthBotSession:
             if not next_node or next_node == END:
                 return  # Conversation done
 
+            self._speculate(next_node, state.values)
+
             # Yield appropriate input request and wait for user response
-            if next_node == "ask_for_quiz":
-                user_response = yield UserInputRequest(
-                    prompt="Would you like to do a quiz about this topic?",
-                    input_type="quiz_choice",
-                    options=["Yes", "No"]
-                )
-                choice = "yes" if user_response.lower().strip() in ["y",
-                                                                    "yes"] \
-                    else "no"
-                graph.update_state(self.config, {"quiz_choice": choice})
-                input_data = None  # No new input data needed, just continue
-
-            elif next_node == "grade_quiz":
-                user_response = yield UserInputRequest(
-                    prompt="Please state your answer:",
-                    input_type="quiz_answer"
-                )
-                graph.update_state(self.config, {"quiz_answer": user_response})
-                input_data = None
-
-            elif next_node == "ask_for_new_topic":
-                user_response = yield UserInputRequest(
-                    prompt="Would you like to discuss another topic?",
-                    input_type="new_topic_choice",
-                    options=["Yes", "No"]
-                )
-                choice = "yes" if user_response.lower().strip() in ["y",
-                                                                    "yes"] \
-                    else "no"
-                graph.update_state(self.config, {"new_topic_choice": choice})
-                input_data = None
-
-            elif next_node == "ask_topic_question":
-                user_response = yield UserInputRequest(
-                    prompt="What health topic would you like me to research?",
-                    input_type="new_question"
-                )
-                # For new questions, we reset and restart with new input
-                self.initial_question = user_response
-                self.last_printed_message_id = None
-                # Clear the thread to start fresh
-                self.thread_id = str(uuid.uuid4())
-                self.config["configurable"]["thread_id"] = self.thread_id
-                input_data = {"user_question": user_response}
\ No newline at end of file
+            request = self._input_request(next_node)
+            asked = time.perf_counter()
+            user_response = yield request
+            metrics.interrupt_wait.observe(time.perf_counter() - asked,
+                                           input_type=request.input_type)
+            update, input_data, old_thread_id = self._handle_response(
+                next_node, user_response)
+            if old_thread_id:
+                graph.checkpointer.delete_thread(old_thread_id)
+            if update:
+                graph.update_state(self.config, update)
+
+    async def arun_conversation(self):
+        """Async counterpart of run_conversation(), driven with asend().
+        LLM and search calls are awaited, so a single event loop can serve
+        many sessions concurrently."""
+
+        input_data = {"user_question": self.initial_question}
+
+        while True:
+            graph = get_graph()
+            async for mode, event in graph.astream(
+                    input=input_data, config=self.config,
+                    stream_mode=self._stream_mode()):
+                for output in self._outputs(mode, event):
+                    yield output
+
+            state = await graph.aget_state(self.config)
+            next_node = state.next[0] if state.next else None
+
+            if not next_node or next_node == END:
+                return
+
+            self._speculate(next_node, state.values)
+            request = self._input_request(next_node)
+            asked = time.perf_counter()
+            user_response = yield request
+            metrics.interrupt_wait.observe(time.perf_counter() - asked,
+                                           input_type=request.input_type)
+            update, input_data, old_thread_id = self._handle_response(
+                next_node, user_response)
+            if old_thread_id:
+                await graph.checkpointer.adelete_thread(old_thread_id)
+            if update:
+                await graph.aupdate_state(self.config, update)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HealthBot utilities")
+    commands = parser.add_subparsers(dest="command", required=True)
+    draw = commands.add_parser("draw", help="render the workflow diagram")
+    draw.add_argument("--output", default="health_bot_workflow.png")
+    args = parser.parse_args()
+
+    if args.command == "draw":
+        draw_graph(args.output)
+        print(f"Wrote {args.output}")
@@ -0,0 +1,65 @@
+import re
+from typing import List
+
+from langchain_core.messages import BaseMessage, RemoveMessage, ToolMessage
+
+# Content of a search result that has already been summarized
+TOOL_STUB = "[search results summarized above]"
+
+
+def _gist(text: str, max_chars: int = 200) -> str:
+    """First sentence of text, at most max_chars long"""
+    text = " ".join(text.split())
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars - 1].rstrip() + "…"
+    return sentence
+
+
+def rolling_summary(summary: str, messages: List[BaseMessage],
+                    max_chars: int, boilerplate: tuple = ()) -> str:
+    """summary extended with one line per question and answer in messages,
+    leaving out the boilerplate prefixes of answers. The oldest lines are
+    dropped to stay within max_chars."""
+    lines = summary.splitlines() if summary else []
+    for message in messages:
+        if message.type == "human":
+            lines.append(f"User: {_gist(message.content)}")
+        elif message.type == "ai" and message.content:
+            content = message.content
+            for prefix in boilerplate:
+                content = content.removeprefix(prefix)
+            if content.strip():
+                lines.append(f"HealthBot: {_gist(content)}")
+    while lines and len("\n".join(lines)) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def stub(message: ToolMessage) -> ToolMessage:
+    # Same id, so add_messages replaces the message in place
+    return ToolMessage(content=TOOL_STUB, name=message.name,
+                       tool_call_id=message.tool_call_id, id=message.id,
+                       status=message.status)
+
+
+def fold_history(messages: List[BaseMessage], window: int, summary: str,
+                 max_chars: int = 1500, boilerplate: tuple = ()) -> tuple:
+    """Updates for add_messages that keep the last window messages (system
+    messages aside) and remove older ones, plus the rolling summary with
+    the removed messages folded in.
+
+    Meant to run when a new topic starts, when every search result in
+    messages has been summarized: the kept ones are replaced by stubs, so
+    they no longer cost prompt tokens but the tool calls stay answered.
+    """
+    history = [m for m in messages if m.type != "system"]
+    cut = max(len(history) - window, 0)
+    # Never start the window with results cut off from their tool call
+    while cut < len(history) and history[cut].type == "tool":
+        cut += 1
+    updates = [RemoveMessage(id=m.id) for m in history[:cut]]
+    updates += [stub(m) for m in history[cut:]
+                if m.type == "tool" and m.content != TOOL_STUB]
+    return updates, rolling_summary(summary, history[:cut], max_chars,
+                                    boilerplate)
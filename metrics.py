@@ -0,0 +1,278 @@
+"""In-process metrics for the health bot: node latency and token usage,
+time users spend at each interrupt, active sessions and cache counters.
+
+Exposed in Prometheus text format at /metrics and as JSON at
+/metrics.json by serve(), or read directly with snapshot().
+"""
+import inspect
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+PREFIX = "healthbot"
+# Seconds; LLM nodes take ~1-10s, local nodes well under 10ms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30)
+# Users answer prompts in seconds to minutes
+WAIT_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base for metrics with a fixed set of label names"""
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self.labels = labels
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_label_text(self.labels, key)} {value}"
+            for key, value in sorted(values.items())]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"/".join(key) or "value": value
+                    for key, value in self._values.items()}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list:
+        with self._lock:
+            values = {key: (list(counts), total)
+                      for key, (counts, total) in self._values.items()}
+        lines = self.header()
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _label_text(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = dict(self._values)
+        return {"/".join(key) or "value": {
+                    "count": sum(counts), "sum": total,
+                    "mean": total / sum(counts),
+                    "buckets": dict(zip(map(str, self.buckets + ("+Inf",)),
+                                        counts))}
+                for key, (counts, total) in values.items()}
+
+
+class Registry:
+    """All metrics of the process, plus collectors: callables returning a
+    dict of numbers (e.g. a cache's report()) read at scrape time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = {}  # name -> callable
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, name: str, report: Callable[[], Dict]):
+        self.collectors[name] = report
+
+    def _collected(self) -> dict:
+        collected = {}
+        for name, report in list(self.collectors.items()):
+            try:
+                collected[name] = {key: value for key, value in
+                                   report().items()
+                                   if isinstance(value, (int, float))}
+            except Exception:
+                pass  # A broken collector must not break the scrape
+        return collected
+
+    def render(self) -> str:
+        """All metrics in Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for name, values in self._collected().items():
+            for key, value in values.items():
+                metric_name = f"{PREFIX}_{name}_{key}"
+                lines += [f"# TYPE {metric_name} gauge",
+                          f"{metric_name} {float(value)}"]
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        snapshot = {metric.name[len(PREFIX) + 1:]: metric.snapshot()
+                    for metric in self.metrics}
+        snapshot.update(self._collected())
+        return snapshot
+
+
+registry = Registry()
+node_duration = registry.add(Histogram(
+    "node_duration_seconds", "Time spent in each graph node", ("node",)))
+node_errors = registry.add(Counter(
+    "node_errors_total", "Graph node runs that raised", ("node",)))
+llm_tokens = registry.add(Counter(
+    "llm_tokens_total", "LLM tokens used by each graph node",
+    ("node", "kind")))
+interrupt_wait = registry.add(Histogram(
+    "interrupt_wait_seconds", "Time users take to answer each prompt",
+    ("input_type",), WAIT_BUCKETS))
+queue_wait = registry.add(Histogram(
+    "scheduler_queue_wait_seconds",
+    "Time LLM and search calls waited for admission",
+    ("upstream", "priority")))
+
+
+def record_tokens(node: str, output):
+    """Add up the token usage of the AI messages a node returned"""
+    if not isinstance(output, dict):
+        return
+    for message in output.get("messages") or []:
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            llm_tokens.inc(usage.get("input_tokens", 0), node=node,
+                           kind="prompt")
+            llm_tokens.inc(usage.get("output_tokens", 0), node=node,
+                           kind="completion")
+
+
+def instrument(name: str, func: Callable,
+               afunc: Optional[Callable] = None) -> RunnableLambda:
+    """Wrap a graph node (and its async variant) to record its latency,
+    errors and token usage under name"""
+
+    def takes_config(fn) -> bool:
+        return fn is not None and \
+            "config" in inspect.signature(fn).parameters
+
+    func_config, afunc_config = takes_config(func), takes_config(afunc)
+
+    def run(state, config: RunnableConfig):
+        started = time.perf_counter()
+        try:
+            output = func(state, config) if func_config else func(state)
+        except Exception:
+            node_errors.inc(node=name)
+            raise
+        finally:
+            node_duration.observe(time.perf_counter() - started, node=name)
+        if output is not state:  # pass-through breakpoint nodes
+            record_tokens(name, output)
+        return output
+
+    async def arun(state, config: RunnableConfig):
+        started = time.perf_counter()
+        try:
+            output = await (afunc(state, config) if afunc_config
+                            else afunc(state))
+        except Exception:
+            node_errors.inc(node=name)
+            raise
+        finally:
+            node_duration.observe(time.perf_counter() - started, node=name)
+        if output is not state:  # pass-through breakpoint nodes
+            record_tokens(name, output)
+        return output
+
+    return RunnableLambda(run, arun if afunc else None, name=name)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = registry.render().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body = json.dumps(registry.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Start the metrics endpoint in a daemon thread (once per process)"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True,
+                             name="metrics").start()
+    return _server
+
+
+def snapshot() -> dict:
+    return registry.snapshot()
@@ -0,0 +1,58 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """Chat model settings for one graph node. Nodes with equal profiles
+    share one client."""
+    model: str = "gpt-4o-mini"
+    temperature: float = 0.2
+    max_tokens: Optional[int] = None  # Output cap, None for no cap
+    tools: bool = False  # Bind the web_search tool
+    # Answer repeated identical calls from the LLM response cache (if
+    # LLM_CACHE_SIZE enables it)
+    cache: bool = False
+
+
+# Only the research agent calls tools; the other nodes produce short,
+# bounded outputs from their inputs alone, so they may be cached
+DEFAULT_PROFILES = {
+    "agent": ModelProfile(tools=True),
+    "summarize": ModelProfile(max_tokens=700, cache=True),
+    # FUSED_SUMMARY: summary, quiz question and answer key in one call
+    "summarize_quiz": ModelProfile(max_tokens=900, cache=True),
+    "generate_quiz": ModelProfile(max_tokens=80, cache=True),
+    "grade_quiz": ModelProfile(temperature=0.0, max_tokens=250, cache=True),
+}
+
+# What every node used before per-node profiles, for comparisons
+LEGACY_PROFILE = ModelProfile(tools=True)
+
+
+def profiles_from_env(defaults: dict = None) -> dict:
+    """Profiles per node. LLM_MODEL sets the model of every node;
+    LLM_<NODE>_MODEL, _TEMPERATURE, _MAX_TOKENS (0 for no cap), _TOOLS and
+    _CACHE (true/false) override one node, e.g.
+    LLM_GRADE_QUIZ_MODEL=gpt-4.1-nano
+    """
+    profiles = {}
+    for node, profile in (defaults or DEFAULT_PROFILES).items():
+        prefix = f"LLM_{node.upper()}"
+        model = os.getenv(f"{prefix}_MODEL") or os.getenv("LLM_MODEL")
+        temperature = os.getenv(f"{prefix}_TEMPERATURE")
+        max_tokens = os.getenv(f"{prefix}_MAX_TOKENS")
+        tools = os.getenv(f"{prefix}_TOOLS")
+        cache = os.getenv(f"{prefix}_CACHE")
+        profiles[node] = replace(
+            profile,
+            model=model or profile.model,
+            temperature=float(temperature) if temperature
+            else profile.temperature,
+            max_tokens=(int(max_tokens) or None) if max_tokens
+            else profile.max_tokens,
+            tools=tools.lower() == "true" if tools else profile.tools,
+            cache=cache.lower() == "true" if cache else profile.cache,
+        )
+    return profiles
@@ -0,0 +1,65 @@
+"""Exact-match cache of LLM responses.
+
+A call is keyed on a hash of the node's model settings, the structured
+output schema (if any) and the messages in canonical form, i.e. without
+the ids and metadata that differ between otherwise identical calls. Values
+are AI messages as JSON dicts, so they fit both tiers of cache.Cache.
+"""
+import hashlib
+import json
+from dataclasses import asdict
+from typing import Optional
+
+from langchain_core.messages import (BaseMessage, message_to_dict,
+                                     messages_from_dict)
+from pydantic import ValidationError
+
+from model_profiles import ModelProfile
+
+
+def canonical(message: BaseMessage) -> dict:
+    entry = {"type": message.type, "content": message.content}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        entry["tool_calls"] = [{"name": call["name"], "args": call["args"]}
+                               for call in tool_calls]
+    return entry
+
+
+def cache_key(profile: ModelProfile, messages: list, schema=None) -> str:
+    settings = asdict(profile)
+    settings.pop("cache")
+    payload = {
+        "profile": settings,
+        "schema": schema.model_json_schema() if schema else None,
+        "messages": [canonical(message) for message in messages],
+    }
+    return hashlib.sha256(json.dumps(
+        payload, sort_keys=True, ensure_ascii=False, default=str
+    ).encode()).hexdigest()
+
+
+def cache_value(output) -> Optional[dict]:
+    """What to store for an LLM output: the AI message, or None if the
+    output should not be cached (structured output that did not parse)"""
+    if isinstance(output, dict):
+        if output.get("parsed") is None:
+            return None
+        output = output["raw"]
+    return message_to_dict(output)
+
+
+def cached_output(value: dict, schema=None):
+    """The LLM output a stored value stands for"""
+    message = messages_from_dict([value])[0]
+    # A new message (add_messages would replace one with the same id) that
+    # used no tokens
+    message = message.model_copy(update={"id": None,
+                                         "usage_metadata": None})
+    if schema is None:
+        return message
+    try:
+        parsed = schema(**message.tool_calls[0]["args"])
+    except (IndexError, ValidationError):
+        parsed = None
+    return {"raw": message, "parsed": parsed, "parsing_error": None}
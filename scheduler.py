@@ -0,0 +1,346 @@
+"""Process-wide admission control for upstream calls (the LLM and the
+search API).
+
+Each upstream has a concurrency limit and token-bucket limits for requests
+and tokens per minute. Calls that cannot start at once queue by priority:
+first by class (interactive turns before batch jobs before speculative
+work), then by how short the call is (grading before summarizing), then
+first come, first served. Sync and async callers share one queue.
+
+    with scheduler.admit("llm", "grade_quiz", tokens=900):
+        llm.invoke(...)
+
+The class comes from the priority() context, so batch.py only has to wrap
+its conversations in `with priority(BATCH)`. Work run under a Ticket
+instead can be promoted to a higher class, or withdrawn, while its calls
+are still queued.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+import metrics
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+SPECULATIVE = "speculative"
+CLASSES = (INTERACTIVE, BATCH, SPECULATIVE)
+
+# Within a class, calls with short outputs go first, so a grading call
+# does not wait behind summaries
+CALL_RANKS = {"grade_quiz": 0, "generate_quiz": 0, "agent": 1,
+              "web_search": 1, "summarize": 2, "summarize_quiz": 2}
+
+_priority_class = contextvars.ContextVar("priority_class",
+                                         default=INTERACTIVE)
+_ticket = contextvars.ContextVar("ticket", default=None)
+
+
+class Withdrawn(Exception):
+    """Raised by admit() for a call cancelled while it was queued"""
+
+
+class Ticket:
+    """A priority class that can change while the calls made under it
+    wait: promote() moves them up the queue, cancel() withdraws them. Use
+    it in place of a class: `with priority(ticket)`."""
+
+    def __init__(self, priority_class: str):
+        self.priority_class = priority_class
+        self.cancelled = False
+        self._queued = []  # (upstream, waiter)
+        self._lock = threading.Lock()
+
+    def promote(self, priority_class: str):
+        """Raise the class of queued and later calls to priority_class,
+        unless it is lower"""
+        with self._lock:
+            if CLASSES.index(priority_class) >= \
+                    CLASSES.index(self.priority_class):
+                return
+            self.priority_class = priority_class
+            for upstream, waiter in self._queued:
+                upstream._promote(waiter, priority_class)
+
+    def cancel(self):
+        """Withdraw queued calls; later ones raise Withdrawn at once"""
+        with self._lock:
+            self.cancelled = True
+            for upstream, waiter in self._queued:
+                upstream._cancel(waiter)
+
+
+@contextmanager
+def priority(priority_class):
+    """Run the calls made inside the block at priority_class, a class
+    name or a Ticket"""
+    ticket = priority_class if isinstance(priority_class, Ticket) else None
+    tokens = (_ticket.set(ticket),
+              _priority_class.set(ticket.priority_class if ticket
+                                  else priority_class))
+    try:
+        yield
+    finally:
+        _priority_class.reset(tokens[1])
+        _ticket.reset(tokens[0])
+
+
+def current_priority() -> str:
+    """The class calls made here would queue at"""
+    ticket = _ticket.get()
+    return ticket.priority_class if ticket else _priority_class.get()
+
+
+class TokenBucket:
+    """Allows per_minute units per minute, in bursts of up to a minute's
+    worth. Taking more than is available leaves a debt later callers wait
+    for, so estimates can be corrected after the fact with refund()."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity,
+                         self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount: float) -> float:
+        """Seconds until amount (at most the capacity) is available"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+
+    def __init__(self, tokens: float, wake):
+        self.tokens = tokens
+        self.wake = wake  # Called, under the upstream lock, once admitted
+        self.admitted = False
+        self.cancelled = False
+
+
+class Upstream:
+    """Admission to one upstream service. A limit of 0 means unlimited."""
+
+    def __init__(self, name: str, concurrency: int = 0, rpm: float = 0,
+                 tpm: float = 0):
+        self.name = name
+        self.concurrency = concurrency
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.active = 0
+        self.admitted = 0
+        self._queue = []  # (class, rank, sequence, waiter)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._timer = None  # Retries admission once the buckets refill
+
+    def _enqueue(self, call: str, tokens: float, wake) -> _Waiter:
+        waiter = _Waiter(tokens, wake)
+        ticket = _ticket.get()
+        if ticket is None:
+            self._push(call, _priority_class.get(), waiter)
+            return waiter
+        # Under the ticket's lock, so a promote() or cancel() running
+        # meanwhile cannot miss this call
+        with ticket._lock:
+            if ticket.cancelled:
+                waiter.cancelled = True
+                return waiter
+            self._push(call, ticket.priority_class, waiter)
+            ticket._queued.append((self, waiter))
+        return waiter
+
+    def _push(self, call: str, priority_class: str, waiter: _Waiter):
+        key = (CLASSES.index(priority_class), CALL_RANKS.get(call, 1),
+               next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._queue, (*key, waiter))
+            self._dispatch()
+
+    def _dispatch(self):
+        # Admit queued calls in priority order while limits allow; the lock
+        # is held
+        while self._queue:
+            waiter = self._queue[0][-1]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if self.concurrency and self.active >= self.concurrency:
+                return
+            delay = max(self.requests.wait(1) if self.requests else 0,
+                        self.tokens.wait(waiter.tokens) if self.tokens
+                        else 0)
+            if delay > 0:
+                # Lower priority calls must not overtake this one either
+                if self._timer is None:
+                    self._timer = threading.Timer(delay, self._retry)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            heapq.heappop(self._queue)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(waiter.tokens)
+            self.active += 1
+            self.admitted += 1
+            waiter.admitted = True
+            waiter.wake()
+
+    def _retry(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _release(self, estimated: float, used: Optional[float]):
+        with self._lock:
+            self.active -= 1
+            if self.tokens and used is not None:
+                self.tokens.refund(estimated - used)
+            self._dispatch()
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """Withdraw a queued call and wake its caller; False if it was
+        admitted already"""
+        with self._lock:
+            if waiter.admitted:
+                return False
+            if not waiter.cancelled:
+                waiter.cancelled = True
+                waiter.wake()
+            return True
+
+    def _promote(self, waiter: _Waiter, priority_class: str) -> bool:
+        """Move a queued call up to priority_class; False if it is no
+        longer queued"""
+        rank = CLASSES.index(priority_class)
+        with self._lock:
+            if waiter.admitted or waiter.cancelled:
+                return False
+            for position, entry in enumerate(self._queue):
+                if entry[-1] is waiter:
+                    if rank < entry[0]:
+                        # Keeps its sequence number, so it goes ahead of
+                        # calls of its new class that queued after it
+                        self._queue[position] = (rank, *entry[1:])
+                        heapq.heapify(self._queue)
+                        self._dispatch()
+                    return True
+            return False
+
+    def report(self) -> dict:
+        with self._lock:
+            queued = sum(1 for entry in self._queue if not entry[-1].cancelled)
+        return {"active": self.active, "queued": queued,
+                "admitted": self.admitted}
+
+
+class Admission:
+    """Handed out by admit(); record the tokens a call actually used with
+    used(), so the tokens-per-minute bucket reflects them"""
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.used_tokens = None
+
+    def used(self, tokens: Optional[float]):
+        self.used_tokens = tokens
+
+
+class Scheduler:
+
+    def __init__(self, upstreams: dict):
+        self.upstreams = upstreams  # name -> Upstream
+
+    @contextmanager
+    def admit(self, upstream: str, call: str, tokens: float = 0):
+        """Block until the call may start, then hold its slot for the
+        block"""
+        target = self.upstreams[upstream]
+        admitted = threading.Event()
+        queued = time.perf_counter()
+        waiter = target._enqueue(call, tokens, admitted.set)
+        if not waiter.cancelled:
+            admitted.wait()
+        if waiter.cancelled:
+            raise Withdrawn(f"{call} was cancelled while queued")
+        metrics.queue_wait.observe(time.perf_counter() - queued,
+                                   upstream=upstream,
+                                   priority=current_priority())
+        admission = Admission(tokens)
+        try:
+            yield admission
+        finally:
+            target._release(tokens, admission.used_tokens)
+
+    @asynccontextmanager
+    async def aadmit(self, upstream: str, call: str, tokens: float = 0):
+        """admit() for coroutines: waits without blocking the event loop"""
+        target = self.upstreams[upstream]
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(
+                lambda: admitted.done() or admitted.set_result(None))
+
+        queued = time.perf_counter()
+        waiter = target._enqueue(call, tokens, wake)
+        try:
+            if not waiter.cancelled:
+                await admitted
+        except asyncio.CancelledError:
+            if not target._cancel(waiter):
+                target._release(tokens, 0)
+            raise
+        if waiter.cancelled:
+            raise Withdrawn(f"{call} was cancelled while queued")
+        metrics.queue_wait.observe(time.perf_counter() - queued,
+                                   upstream=upstream,
+                                   priority=current_priority())
+        admission = Admission(tokens)
+        try:
+            yield admission
+        finally:
+            target._release(tokens, admission.used_tokens)
+
+    def report(self) -> dict:
+        return {f"{name}_{key}": value
+                for name, upstream in self.upstreams.items()
+                for key, value in upstream.report().items()}
+
+    @classmethod
+    def from_env(cls) -> "Scheduler":
+        """Limits from SCHEDULER_LLM_CONCURRENCY, SCHEDULER_LLM_RPM,
+        SCHEDULER_LLM_TPM, SCHEDULER_SEARCH_CONCURRENCY and
+        SCHEDULER_SEARCH_RPM; unset or 0 means unlimited"""
+
+        def limit(name: str) -> float:
+            return float(os.getenv(f"SCHEDULER_{name}", 0))
+
+        return cls({
+            "llm": Upstream("llm", int(limit("LLM_CONCURRENCY")),
+                            rpm=limit("LLM_RPM"), tpm=limit("LLM_TPM")),
+            "search": Upstream("search", int(limit("SEARCH_CONCURRENCY")),
+                               rpm=limit("SEARCH_RPM")),
+        })
@@ -0,0 +1,209 @@
+import asyncio
+import functools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import normalize_query
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SearchError(Exception):
+    """The search API answered with an error that retrying will not fix"""
+
+    def __init__(self, status: int, body: str):
+        super().__init__(f"Search API returned {status}: {body[:200]}")
+        self.status = status
+
+
+def backoff_delay(attempt: int, base: float, cap: float,
+                  retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before retry number attempt (0-based): the server's
+    Retry-After if given, otherwise exponential backoff with full jitter"""
+    if retry_after:
+        try:
+            return min(float(retry_after), cap)
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class SearchClient:
+    """Process-wide Tavily search client.
+
+    Connections are pooled and kept alive across searches; at most
+    max_connections requests run at once. Responses with a status in
+    RETRY_STATUSES (and connection errors) are retried with jittered
+    exponential backoff. Identical searches that are in flight at the same
+    time are coalesced into one upstream request whose result they share.
+    """
+
+    def __init__(self, api_key: Optional[str] = None,
+                 base_url: str = "https://api.tavily.com",
+                 max_connections: int = 10, max_retries: int = 3,
+                 backoff: float = 0.5, backoff_cap: float = 8.0,
+                 timeout: float = 60):
+        self.url = base_url.rstrip("/") + "/search"
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(_headers(api_key))
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._in_flight = {}  # key -> Future of the leading request
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    def search(self, query: str, **kwargs) -> Dict:
+        key = _flight_key(query, kwargs)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            response = self._request({"query": query, **kwargs})
+            future.set_result(response)
+            return response
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _request(self, payload: dict) -> Dict:
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                with self._slots:
+                    self.requests += 1
+                    response = self.session.post(self.url, json=payload,
+                                                 timeout=self.timeout)
+            except requests.ConnectionError:
+                if last_attempt:
+                    raise
+                retry_after = None
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    raise SearchError(response.status_code, response.text)
+                retry_after = response.headers.get("Retry-After")
+            self.retries += 1
+            time.sleep(backoff_delay(attempt, self.backoff, self.backoff_cap,
+                                     retry_after))
+
+    def report(self) -> dict:
+        return {"requests": self.requests, "retries": self.retries,
+                "coalesced": self.coalesced}
+
+
+class AsyncSearchClient:
+    """asyncio counterpart of SearchClient, built on one pooled
+    httpx.AsyncClient. Bound to the event loop it is first used on."""
+
+    def __init__(self, api_key: Optional[str] = None,
+                 base_url: str = "https://api.tavily.com",
+                 max_connections: int = 10, max_retries: int = 3,
+                 backoff: float = 0.5, backoff_cap: float = 8.0,
+                 timeout: float = 60):
+        import httpx
+        self._httpx = httpx
+        self.url = base_url.rstrip("/") + "/search"
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.client = httpx.AsyncClient(
+            headers=_headers(api_key), timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections))
+        self._in_flight = {}  # key -> asyncio.Task of the shared request
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    async def search(self, query: str, **kwargs) -> Dict:
+        key = _flight_key(query, kwargs)
+        task = self._in_flight.get(key)
+        if task is None:
+            # A task of its own, so cancelling the caller that started it
+            # does not fail the others waiting for the same response
+            task = self._in_flight[key] = asyncio.ensure_future(
+                self._request({"query": query, **kwargs}))
+            task.add_done_callback(functools.partial(self._landed, key))
+        else:
+            self.coalesced += 1
+        # shield: a cancelled caller must not cancel the request
+        return await asyncio.shield(task)
+
+    def _landed(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # Don't warn if every caller was cancelled
+
+    async def _request(self, payload: dict) -> Dict:
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                self.requests += 1
+                response = await self.client.post(self.url, json=payload)
+            except self._httpx.TransportError:
+                if last_attempt:
+                    raise
+                retry_after = None
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    raise SearchError(response.status_code, response.text)
+                retry_after = response.headers.get("Retry-After")
+            self.retries += 1
+            await asyncio.sleep(backoff_delay(attempt, self.backoff,
+                                              self.backoff_cap, retry_after))
+
+    def report(self) -> dict:
+        return {"requests": self.requests, "retries": self.retries,
+                "coalesced": self.coalesced}
+
+
+def _headers(api_key: Optional[str]) -> dict:
+    return {"Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+            "X-Client-Source": "tavily-python"}
+
+
+def _flight_key(query: str, kwargs: dict) -> str:
+    return normalize_query(query) + json.dumps(kwargs, sort_keys=True)
+
+
+def client_settings() -> dict:
+    """Client settings from TAVILY_API_KEY, TAVILY_API_URL (e.g. a local
+    stand-in server), SEARCH_MAX_CONNECTIONS and SEARCH_MAX_RETRIES"""
+    return {
+        "api_key": os.getenv("TAVILY_API_KEY"),
+        "base_url": os.getenv("TAVILY_API_URL", "https://api.tavily.com"),
+        "max_connections": int(os.getenv("SEARCH_MAX_CONNECTIONS", 10)),
+        "max_retries": int(os.getenv("SEARCH_MAX_RETRIES", 3)),
+    }
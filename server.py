@@ -0,0 +1,192 @@
+"""Stateless HTTP/JSON API for the health bot.
+
+    POST /sessions                    {"question": "..."}
+    POST /sessions/<thread_id>/reply  {"answer": "..."}
+    GET  /sessions/<thread_id>        the pending request, e.g. after a
+                                      reconnect
+
+Each call answers with the new bot messages and the next input request:
+
+    {"thread_id": "...", "messages": ["..."], "done": false,
+     "request": {"prompt": "...", "input_type": "quiz_choice",
+                 "options": ["Yes", "No"]}}
+
+A new topic continues under a new thread_id (the same one with
+HISTORY_WINDOW), so clients must use the one from the latest response. A
+reply sent while another reply to the same conversation is still running
+gets a 409.
+Progress lives in the checkpointer, not in the process, so with a shared
+CHECKPOINT_PATH any worker can serve any call:
+
+    CHECKPOINT_PATH=state.db python server.py --port 8000 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import health_bot
+import metrics
+from health_bot import ConversationConflict, HealthBotSession
+
+SESSION_PATH = re.compile(r"^/sessions/([\w-]+)(/reply)?$")
+
+
+class ApiError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def turn(session: HealthBotSession, messages: list, request) -> dict:
+    return {"thread_id": session.thread_id, "messages": messages,
+            "request": asdict(request) if request else None,
+            "done": request is None}
+
+
+def start_session(body: dict) -> dict:
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ApiError(400, "question is required")
+    session = HealthBotSession(question.strip())
+    return turn(session, *session.step())
+
+
+def reply(thread_id: str, body: dict) -> dict:
+    answer = body.get("answer")
+    if not isinstance(answer, str) or not answer.strip():
+        raise ApiError(400, "answer is required")
+    session = HealthBotSession.resume(thread_id)
+    if session.pending_request() is None:
+        raise ApiError(409 if conversation_exists(session) else 404,
+                       f"Conversation {thread_id} is not waiting for input")
+    try:
+        return turn(session, *session.step(answer.strip()))
+    except ConversationConflict as error:
+        raise ApiError(409, str(error))
+
+
+def pending(thread_id: str) -> dict:
+    session = HealthBotSession.resume(thread_id)
+    if not conversation_exists(session):
+        raise ApiError(404, f"Unknown conversation {thread_id}")
+    return turn(session, [], session.pending_request())
+
+
+def conversation_exists(session: HealthBotSession) -> bool:
+    return bool(health_bot.get_graph().get_state(session.config).values)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ApiError(400, "body must be JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "body must be a JSON object")
+        return body
+
+    def handle_api(self, route):
+        try:
+            self.send_json(200, route())
+        except ApiError as error:
+            self.send_json(error.status, {"error": str(error)})
+        except Exception as error:
+            self.send_json(500, {"error": repr(error)})
+
+    def do_POST(self):
+        if self.path == "/sessions":
+            self.handle_api(lambda: start_session(self.read_json()))
+            return
+        match = SESSION_PATH.match(self.path)
+        if match and match.group(2):
+            self.handle_api(lambda: reply(match.group(1), self.read_json()))
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_GET(self):
+        match = SESSION_PATH.match(self.path)
+        if match and not match.group(2):
+            self.handle_api(lambda: pending(match.group(1)))
+        elif self.path == "/healthz":
+            self.send_json(200, {"status": "ok", "pid": os.getpid()})
+        elif self.path == "/metrics":
+            body = metrics.registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Lets every worker process bind the same port; the kernel spreads
+    # connections across them
+    allow_reuse_port = True
+
+
+def serve(host: str, port: int):
+    # Build the graph before accepting connections
+    health_bot.get_graph()
+    server = ApiServer((host, port), ApiHandler)
+    print(f"HealthBot API on http://{host}:{port} (pid {os.getpid()})",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_workers(host: str, port: int, workers: int):
+    """Run the server in several processes sharing one port"""
+    processes = [multiprocessing.Process(target=serve, args=(host, port))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HealthBot HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes sharing the port (needs a shared "
+                             "CHECKPOINT_PATH)")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        if not os.getenv("CHECKPOINT_PATH"):
+            sys.exit("--workers > 1 needs CHECKPOINT_PATH, a SQLite file "
+                     "shared by the workers")
+        serve_workers(args.host, args.port, args.workers)
+    else:
+        serve(args.host, args.port)
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import Executor
+from typing import Optional
+
+from health_bot import HealthBotSession, TokenDelta, UserInputRequest
+
+
+class SessionWorker:
+    """Drives a HealthBotSession on a background thread, one step at a
+    time. A step runs until the bot asks for input or the conversation
+    ends; meanwhile the UI polls for the text generated so far instead of
+    blocking on it.
+    """
+
+    def __init__(self, session: HealthBotSession, executor: Executor):
+        self.session = session
+        self.executor = executor
+        self._conversation = session.run_conversation()
+        self._lock = threading.Lock()
+        self._future = None
+        self._messages = []  # Finished AI messages not yet polled
+        self.partial = ""  # The AI message being generated
+        self.request: Optional[UserInputRequest] = None
+        self.done = False
+        self.error: Optional[Exception] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def step(self, user_input: str = None):
+        """Start the next step in the background. user_input answers the
+        pending request; leave it out for the first step."""
+        if self.busy:
+            raise RuntimeError("A step is already running")
+        self.request = None
+        self._future = self.executor.submit(self._run, user_input)
+
+    def _run(self, user_input: Optional[str]):
+        try:
+            if user_input is None:
+                result = next(self._conversation)
+            else:
+                result = self._conversation.send(user_input)
+            while not isinstance(result, UserInputRequest):
+                with self._lock:
+                    if isinstance(result, TokenDelta):
+                        self.partial += result.content
+                    else:
+                        self._messages.append(result)
+                        self.partial = ""
+                result = next(self._conversation)
+            self.request = result
+        except StopIteration:
+            self.done = True
+        except Exception as error:
+            self.error = error
+            self.done = True
+
+    def poll(self) -> tuple:
+        """(AI messages finished since the last poll, text of the message
+        still being generated)"""
+        with self._lock:
+            messages, self._messages = self._messages, []
+            return messages, self.partial
@@ -0,0 +1,438 @@
+"""Local, persistent BM25 index of the web search results we have fetched.
+
+The index is a directory of immutable segments plus a manifest naming the
+live ones. A segment stores its documents as concatenated JSON records and
+its postings as flat numpy arrays, all memory-mapped, so opening a large
+index costs almost nothing and only the pages a query touches are read.
+New results are buffered in memory (and searchable right away) and written
+as a new segment every flush_docs documents by a background thread, so a
+search never waits for the disk. Merging is size-tiered: once there are
+merge_factor segments of about the same size they are merged into one of
+the next size up, so every document is rewritten only a logarithmic number
+of times. Several processes may share the directory; writers take a file
+lock.
+"""
+import atexit
+import json
+import math
+import mmap
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+
+import numpy as np
+
+from answer_cache import STOP_WORDS
+from compaction import _words
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+K1 = 1.2
+B = 0.75
+
+
+def index_terms(text: str) -> List[str]:
+    return [word for word in _words(text) if word not in STOP_WORDS]
+
+
+def document_terms(document: dict) -> List[str]:
+    return index_terms(f"{document.get('title', '')} "
+                       f"{document.get('content', '')}")
+
+
+class Segment:
+    """Immutable, memory-mapped part of the index"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+        def array(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        self.doc_offsets = array("doc_offsets")  # n + 1 byte offsets
+        self.doc_lengths = array("doc_lengths")  # terms per document
+        self.fetched_at = array("fetched_at")
+        self.post_docs = array("post_docs")  # doc numbers, grouped by term
+        self.post_tf = array("post_tf")  # term frequencies, same order
+        with open(os.path.join(path, "terms.json"), encoding="utf-8") as f:
+            self.terms = json.load(f)  # term -> [start, end] in postings
+        with open(os.path.join(path, "docs.bin"), "rb") as f:
+            self._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.total_length = int(self.doc_lengths.sum())
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def postings(self, term: str):
+        start, end = self.terms.get(term, (0, 0))
+        return self.post_docs[start:end], self.post_tf[start:end]
+
+    def document(self, number: int) -> dict:
+        start, end = self.doc_offsets[number], self.doc_offsets[number + 1]
+        return json.loads(self._docs[start:end])
+
+    def documents(self):
+        for number in range(len(self)):
+            yield self.document(number)
+
+    @staticmethod
+    def write(path: str, documents: List[dict]):
+        """Write documents as a new segment at path"""
+        temporary = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        os.makedirs(temporary)
+        records = [json.dumps(d, ensure_ascii=False).encode()
+                   for d in documents]
+        postings = {}  # term -> [(doc, tf)]
+        lengths = []
+        for number, document in enumerate(documents):
+            terms = document_terms(document)
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).append((number, tf))
+
+        terms, post_docs, post_tf = {}, [], []
+        for term in sorted(postings):
+            terms[term] = [len(post_docs), len(post_docs) +
+                           len(postings[term])]
+            for number, tf in postings[term]:
+                post_docs.append(number)
+                post_tf.append(tf)
+
+        def save(name, values, dtype):
+            np.save(os.path.join(temporary, name + ".npy"),
+                    np.asarray(values, dtype=dtype))
+
+        save("doc_offsets", np.cumsum([0] + [len(r) for r in records]),
+             np.int64)
+        save("doc_lengths", lengths, np.int32)
+        save("fetched_at", [d["fetched_at"] for d in documents],
+             np.float64)
+        save("post_docs", post_docs, np.int32)
+        save("post_tf", post_tf, np.int32)
+        with open(os.path.join(temporary, "terms.json"), "w",
+                  encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False, separators=(",", ":"))
+        with open(os.path.join(temporary, "docs.bin"), "wb") as f:
+            f.write(b"".join(records))
+        os.rename(temporary, path)
+
+
+class SourceIndex:
+    """BM25 index over fetched search results that can answer a search
+    locally when it covers the query well enough"""
+
+    def __init__(self, path: str, max_age: float = 7 * 24 * 60 * 60,
+                 min_results: int = 3, min_coverage: float = 0.75,
+                 flush_docs: int = 50, merge_factor: int = 4,
+                 retire_after: float = 60):
+        self.path = path
+        self.max_age = max_age
+        self.min_results = min_results
+        self.min_coverage = min_coverage
+        self.flush_docs = flush_docs
+        self.merge_factor = merge_factor
+        # Merged-away segments stay on disk this long, for readers that
+        # still open them from the manifest they read before the merge
+        self.retire_after = retire_after
+        os.makedirs(path, exist_ok=True)
+        self._segments = {}  # name -> Segment
+        self._retired = {}  # name -> when it left the manifest
+        self._manifest_mtime = None
+        self._buffer = []  # Documents not yet in a segment
+        self._writing = []  # Documents being written, still searchable
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()  # One flush at a time
+        self._flush_wanted = threading.Event()
+        self._thread = None
+        self.local_hits = 0
+        self.misses = 0
+        self.ingested = 0
+        self.merges = 0
+        self.write_errors = 0
+        with self._lock:
+            self._refresh()
+        atexit.register(self.flush)
+
+    @property
+    def _manifest(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    def _refresh(self):
+        # Pick up segments written or merged by other processes; the lock
+        # is held
+        try:
+            mtime = os.stat(self._manifest).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        with open(self._manifest, encoding="utf-8") as f:
+            manifest = json.load(f)
+        names = manifest["segments"]
+        self._retired = manifest.get("retired", {})
+        self._segments = {
+            name: self._segments.get(name) or
+            Segment(os.path.join(self.path, name))
+            for name in names}
+        self._manifest_mtime = mtime
+
+    def _write_manifest(self, names: list, retired: dict):
+        temporary = f"{self._manifest}.tmp-{uuid.uuid4().hex[:8]}"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"segments": names, "retired": retired}, f)
+        os.replace(temporary, self._manifest)
+
+    def _commit(self, names: list, obsolete: list):
+        # The new manifest goes first, so a crash at any point leaves it
+        # naming only segments that exist; obsolete segments are deleted
+        # on a later flush, once retire_after has passed
+        now = time.time()
+        retired = {**self._retired, **dict.fromkeys(obsolete, now)}
+        expired = [name for name, since in retired.items()
+                   if now - since >= self.retire_after]
+        self._write_manifest(names, {name: since
+                                     for name, since in retired.items()
+                                     if name not in expired})
+        for name in expired:
+            # Open mmaps of other processes stay valid after the unlink
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    @contextmanager
+    def _writer_lock(self):
+        with open(os.path.join(self.path, "index.lock"), "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def add(self, response: dict):
+        """Ingest the results of one search response"""
+        now = time.time()
+        documents = [{"url": r["url"], "title": r.get("title", ""),
+                      "content": r["content"], "fetched_at": now}
+                     for r in response.get("results", [])
+                     if r.get("url") and r.get("content")]
+        with self._lock:
+            self._buffer.extend(documents)
+            self.ingested += len(documents)
+            if len(self._buffer) < self.flush_docs:
+                return
+        if self._thread is None:
+            self._start()
+        self._flush_wanted.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name="source-index-writer")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._flush_wanted.wait()
+            self._flush_wanted.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.write_errors += 1
+
+    def flush(self):
+        """Write buffered documents as a new segment and merge segments
+        where a size tier is full. Runs on the writer thread, and at exit
+        for whatever is left."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return
+                documents, self._buffer = self._buffer, []
+                self._writing = documents
+            try:
+                with self._writer_lock():
+                    with self._lock:
+                        self._refresh()
+                        names = list(self._segments)
+                    name = f"seg-{time.time_ns()}-{uuid.uuid4().hex[:6]}"
+                    Segment.write(os.path.join(self.path, name), documents)
+                    self._commit(*self._merge_tiers(names + [name]))
+            except Exception:
+                # Keep the documents for the next flush
+                with self._lock:
+                    self._buffer = documents + self._buffer
+                    self._writing = []
+                raise
+            with self._lock:
+                self._refresh()
+                self._writing = []
+
+    def _segment(self, name: str) -> Segment:
+        return self._segments.get(name) or \
+            Segment(os.path.join(self.path, name))
+
+    def _tier(self, documents: int) -> int:
+        # 0 for up to merge_factor flushes' worth, 1 for up to
+        # merge_factor ** 2, ...
+        ratio = max(documents, 1) / self.flush_docs
+        return max(0, int(math.log(ratio, self.merge_factor))) \
+            if ratio > 1 else 0
+
+    def _merge_tiers(self, names: list) -> tuple:
+        """names with every full size tier merged, smallest first, and the
+        names merged away"""
+        obsolete = []
+        while True:
+            tiers = {}
+            for name in names:
+                tiers.setdefault(self._tier(len(self._segment(name))),
+                                 []).append(name)
+            full = [group for _, group in sorted(tiers.items())
+                    if len(group) >= self.merge_factor]
+            if not full:
+                return names, obsolete
+            merged = self._merge(full[0])
+            obsolete.extend(full[0])
+            names = [name for name in names if name not in full[0]] + \
+                [merged]
+
+    def _merge(self, names: list) -> str:
+        # Keeps only the newest copy of every URL
+        self.merges += 1
+        newest = {}
+        for name in names:
+            segment = self._segment(name)
+            for document in segment.documents():
+                current = newest.get(document["url"])
+                if current is None or \
+                        document["fetched_at"] >= current["fetched_at"]:
+                    newest[document["url"]] = document
+        merged = f"seg-{time.time_ns()}-{uuid.uuid4().hex[:6]}"
+        Segment.write(os.path.join(self.path, merged),
+                      list(newest.values()))
+        return merged
+
+    def search(self, query: str, k: int = 5) -> List[tuple]:
+        """The k best (score, coverage, document) for query, one per URL.
+        coverage is the share of the query's terms the document contains."""
+        terms = set(index_terms(query))
+        with self._lock:
+            self._refresh()
+            segments = list(self._segments.values())
+            buffer = self._writing + self._buffer
+        if not terms:
+            return []
+
+        buffer_terms = [Counter(document_terms(d)) for d in buffer]
+        documents = sum(map(len, segments)) + len(buffer)
+        if not documents:
+            return []
+        average_length = (sum(s.total_length for s in segments) +
+                          sum(sum(c.values()) for c in buffer_terms)) \
+            / documents or 1
+        idf = {}
+        for term in terms:
+            df = sum(len(s.postings(term)[0]) for s in segments) + \
+                sum(1 for c in buffer_terms if c[term])
+            if df:
+                idf[term] = np.log(1 + (documents - df + 0.5) / (df + 0.5))
+
+        candidates = []  # (score, coverage, segment or None, number)
+        for segment in segments:
+            scores = np.zeros(len(segment))
+            matched = np.zeros(len(segment))
+            for term, weight in idf.items():
+                numbers, tf = segment.postings(term)
+                if not len(numbers):
+                    continue
+                lengths = segment.doc_lengths[numbers]
+                scores[numbers] += weight * tf * (K1 + 1) / (
+                    tf + K1 * (1 - B + B * lengths / average_length))
+                matched[numbers] += 1
+            for number in np.argsort(-scores)[:k * 2]:
+                if scores[number] > 0:
+                    candidates.append((float(scores[number]),
+                                       float(matched[number]) / len(terms),
+                                       segment, int(number)))
+        for number, counts in enumerate(buffer_terms):
+            length = sum(counts.values())
+            score = sum(
+                weight * counts[term] * (K1 + 1) / (counts[term] + K1 * (
+                    1 - B + B * length / average_length))
+                for term, weight in idf.items() if counts[term])
+            if score > 0:
+                candidates.append((score, sum(1 for t in terms if counts[t])
+                                   / len(terms), None, number))
+
+        candidates.sort(key=lambda c: -c[0])
+        results, urls = [], set()
+        for score, coverage, segment, number in candidates:
+            document = buffer[number] if segment is None \
+                else segment.document(number)
+            if document["url"] in urls:
+                continue
+            urls.add(document["url"])
+            results.append((score, coverage, document))
+            if len(results) == k:
+                break
+        return results
+
+    def lookup(self, query: str) -> Optional[dict]:
+        """A search response built from the index, if at least min_results
+        fresh documents cover min_coverage of the query; otherwise None"""
+        deadline = time.time() - self.max_age
+        results = [(score, document)
+                   for score, coverage, document in
+                   self.search(query, k=max(5, self.min_results))
+                   if coverage >= self.min_coverage and
+                   document["fetched_at"] >= deadline]
+        if len(results) < self.min_results:
+            self.misses += 1
+            return None
+        self.local_hits += 1
+        return {
+            "query": query,
+            "results": [{"url": d["url"], "title": d["title"],
+                         "content": d["content"], "score": round(score, 3)}
+                        for score, d in results],
+            "response_time": 0.0,
+            "source": "local_index",
+        }
+
+    def report(self) -> dict:
+        with self._lock:
+            return {"documents": sum(map(len, self._segments.values())) +
+                    len(self._writing) + len(self._buffer),
+                    "segments": len(self._segments),
+                    "ingested": self.ingested,
+                    "merges": self.merges,
+                    "write_errors": self.write_errors,
+                    "local_hits": self.local_hits,
+                    "misses": self.misses}
+
+    @classmethod
+    def from_env(cls) -> Optional["SourceIndex"]:
+        """The index at SOURCE_INDEX_PATH (None if unset), answering
+        locally with SOURCE_INDEX_MIN_RESULTS (default 3) results no older
+        than SOURCE_INDEX_MAX_AGE seconds (default 7 days) that contain
+        SOURCE_INDEX_MIN_COVERAGE (default 0.75) of the query's terms"""
+        path = os.getenv("SOURCE_INDEX_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            max_age=float(os.getenv("SOURCE_INDEX_MAX_AGE",
+                                    7 * 24 * 60 * 60)),
+            min_results=int(os.getenv("SOURCE_INDEX_MIN_RESULTS", 3)),
+            min_coverage=float(os.getenv("SOURCE_INDEX_MIN_COVERAGE",
+                                         0.75)),
+        )
@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from scheduler import SPECULATIVE, Ticket, current_priority, priority
+
+
+class Speculator:
+    """Runs work in the background while the user is still deciding whether
+    they need it.
+
+    start() begins the work under a key, its upstream calls queued at
+    SPECULATIVE priority. claim() hands over the Future if the user
+    accepted, raising those calls to the claimer's priority; discard()
+    cancels the work, or withdraws its queued calls, if they declined.
+    Entries never claimed or discarded are dropped oldest first beyond
+    max_pending.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="speculation")
+        self._pending = OrderedDict()  # key -> (Future, Ticket)
+        self._lock = threading.Lock()
+        self.started = 0
+        self.claimed = 0
+        self.claimed_ready = 0
+        self.discarded = 0
+        self.dropped = 0
+
+    def start(self, key: str, fn: Callable):
+        with self._lock:
+            if key in self._pending:
+                return
+            ticket = Ticket(SPECULATIVE)
+
+            def run():
+                with priority(ticket):
+                    return fn()
+
+            self._pending[key] = (self._executor.submit(run), ticket)
+            self.started += 1
+            while len(self._pending) > self.max_pending:
+                _, (future, ticket) = self._pending.popitem(last=False)
+                future.cancel()
+                ticket.cancel()
+                self.dropped += 1
+
+    def claim(self, key: str) -> Optional[Future]:
+        """The Future started under key, or None if there is none or it
+        had not started yet, in which case the caller is better off doing
+        the work itself than waiting for a worker"""
+        with self._lock:
+            future, ticket = self._pending.pop(key, (None, None))
+            if future is None:
+                return None
+            if future.cancel():
+                self.discarded += 1
+                return None
+            # Someone waits for it now, so its calls stop yielding to others
+            ticket.promote(current_priority())
+            self.claimed += 1
+            if future.done():
+                self.claimed_ready += 1
+            return future
+
+    def discard(self, key: str):
+        with self._lock:
+            future, ticket = self._pending.pop(key, (None, None))
+            if future is not None:
+                # Withdraws a call still queued; one already admitted
+                # finishes unused
+                future.cancel()
+                ticket.cancel()
+                self.discarded += 1
+
+    def report(self) -> dict:
+        """How often speculation paid off: claimed / started is the share of
+        speculative calls that were used, claimed_ready the share that were
+        already finished when the user accepted"""
+        return {
+            "started": self.started,
+            "claimed": self.claimed,
+            "claimed_ready": self.claimed_ready,
+            "discarded": self.discarded,
+            "dropped": self.dropped,
+            "hit_rate": self.claimed / self.started if self.started else 0.0,
+        }
@@ -0,0 +1,92 @@
+import re
+
+HEALTH = "health"
+OFF_TOPIC = "off_topic"
+AMBIGUOUS = "ambiguous"
+
+# Whole words, each inflection listed: as prefixes, "pain" would match
+# paint, "flu" fluent and "treat" treaty. One of these is enough to call a
+# question a health question.
+HEALTH_TERMS = (
+    "acne", "addicted", "addiction", "adhd", "allergic", "allergies",
+    "allergy", "alzheimer", "alzheimers", "anaemia", "anemia", "anemic",
+    "anxiety", "anxious", "arthritis", "asthma", "autism", "autistic",
+    "back pain", "bmi", "caffeine", "calorie", "calories", "cancer",
+    "cancers", "cardiovascular", "chemotherapy", "child birth", "childbirth",
+    "cholesterol", "copd", "cough", "coughing", "covid", "dehydrated",
+    "dehydration", "dementia", "dental", "dentist", "depressed",
+    "depression", "diabetes", "diabetic", "diagnosed", "diagnosis",
+    "diarrhea", "diarrhoea", "disease", "diseases", "dizziness", "dizzy",
+    "eczema", "fatigue", "fertility", "flu", "gluten", "hangover",
+    "headache", "headaches", "health", "healthier", "healthy", "hormonal",
+    "hormone", "hormones", "hydration", "hypertension", "immune",
+    "immunity", "infection", "infections", "inflammation", "inflammatory",
+    "influenza", "injuries", "injury", "insomnia", "insulin", "kidney",
+    "kidneys", "liver", "lung", "lungs", "medical", "medication",
+    "medications", "medicine", "medicines", "meditation", "menopause",
+    "migraine", "migraines", "mindfulness", "muscle", "muscles", "nausea",
+    "nutrient", "nutrients", "nutrition", "nutritional", "obese", "obesity",
+    "pain", "painful", "pains", "pandemic", "pregnancy", "pregnant",
+    "prescribed", "prescription", "psychiatrist", "psychologist", "rash",
+    "rehabilitation", "smoking", "sodium", "stomach", "surgeon", "surgery",
+    "symptom", "symptoms", "syndrome", "therapist", "thyroid", "vaccinated",
+    "vaccination", "vaccine", "vaccines", "vitamin", "vitamins",
+    "wellbeing", "wellness", "yoga",
+)
+
+# Words with common non-health senses ("computer virus", "cold war",
+# "sleep mode"); a question needs two of these, or one term above.
+HEALTH_HINTS = (
+    "alcohol", "blood", "bone", "bones", "brain", "breath", "breathing",
+    "chronic", "cold", "colds", "diet", "dieting", "digestion", "digestive",
+    "disorder", "doctor", "doctors", "dosage", "dose", "exercise",
+    "exercises", "exercising", "fever", "fitness", "gut", "hearing",
+    "heart", "infected", "mental", "metabolism", "patient", "patients",
+    "protein", "psychology", "rehab", "sick", "sickness", "skin", "sleep",
+    "sleeping", "smoke", "stress", "stressed", "stroke", "sugar",
+    "supplement", "supplements", "therapy", "treat", "treating",
+    "treatment", "treatments", "virus", "viruses", "weight",
+)
+HEALTH_MIN_HINTS = 2
+
+# Also whole words: as prefixes, "code" would match codeine and "stock"
+# stockings. Words that also occur in health questions ("program",
+# "game", "paint") are left out.
+OFF_TOPIC_WORDS = (
+    "bitcoin", "celebrities", "celebrity", "coding", "compiler", "crypto",
+    "cryptocurrency", "election", "elections", "football", "investing",
+    "investment", "javascript", "lyrics", "movie", "movies", "poem",
+    "poems", "politics", "programming", "python", "recipe for cake",
+    "soccer", "song", "songs", "stock market", "taxes", "translate",
+    "weather",
+)
+
+# A question is refused without asking the LLM only if it has at least
+# this many off-topic words and no health ones
+OFF_TOPIC_MIN_HITS = 2
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _hits(text: str, terms: tuple) -> int:
+    """Number of terms in text, each matched as whole words"""
+    words = _WORD.findall(text)
+    joined = " " + " ".join(words) + " "
+    return sum(f" {term} " in joined for term in terms)
+
+
+def classify(question: str) -> str:
+    """HEALTH, OFF_TOPIC or AMBIGUOUS, from health and off-topic keywords
+    alone. Both need a strong signal, since HEALTH questions skip the agent
+    and OFF_TOPIC ones are refused outright; mixed, weak or keyword-free
+    questions are AMBIGUOUS, so a misjudged question at worst takes the
+    slower LLM route."""
+    text = question.lower()
+    terms = _hits(text, HEALTH_TERMS)
+    hints = _hits(text, HEALTH_HINTS)
+    off_topic = _hits(text, OFF_TOPIC_WORDS)
+    if (terms or hints >= HEALTH_MIN_HINTS) and not off_topic:
+        return HEALTH
+    if off_topic >= OFF_TOPIC_MIN_HITS and not (terms or hints):
+        return OFF_TOPIC
+    return AMBIGUOUS
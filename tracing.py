@@ -0,0 +1,225 @@
+"""Sampled, non-blocking tracing.
+
+TraceHandler is a LangChain callback handler that turns the runs of a
+sampled graph turn (graph, nodes, LLM and tool calls) into spans. Finished
+spans go into a bounded queue and a background thread exports them in
+batches; when the queue is full spans are dropped, so tracing never makes
+a user wait.
+
+    TRACING=sampled TRACE_SAMPLE_RATE=0.1 TRACE_FILE=traces.jsonl
+"""
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    kind: str  # "graph", "chain", "llm" or "tool"
+    start: float
+    end: Optional[float] = None
+    status: str = "ok"
+    attributes: dict = field(default_factory=dict)
+
+
+class JsonlFileExporter:
+    """Appends each span as one JSON line"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(asdict(span), default=str) + "\n")
+
+
+class BatchExporter:
+    """Bounded span queue drained by a daemon thread. submit() never
+    blocks: spans that do not fit are counted as dropped. Exporter errors
+    are counted, not raised."""
+
+    def __init__(self, exporter, max_queue: int = 1000,
+                 batch_size: int = 100, interval: float = 2.0):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    def submit(self, span: Span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name="trace-export")
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(
+                        timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._export(batch)
+
+    def _export(self, batch: list):
+        try:
+            self.exporter.export(batch)
+            self.exported += len(batch)
+        except Exception:
+            self.export_errors += 1
+
+    def flush(self, timeout: float = 5.0):
+        """Export what is queued, e.g. at shutdown"""
+        deadline = time.monotonic() + timeout
+        batch = []
+        while time.monotonic() < deadline:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._export(batch)
+
+    def report(self) -> dict:
+        return {"exported": self.exported, "dropped": self.dropped,
+                "export_errors": self.export_errors,
+                "queued": self._queue.qsize()}
+
+
+class TraceHandler(BaseCallbackHandler):
+    """Records spans for a sample_rate share of graph turns"""
+
+    # Recording a span is cheap; don't hand it to an executor under asyncio
+    run_inline = True
+
+    def __init__(self, exporter: BatchExporter, sample_rate: float = 0.1):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._open = {}  # run_id -> Span of sampled runs still running
+        self.sampled = 0
+
+    def _start(self, kind: str, name: str, run_id, parent_run_id,
+               attributes: dict):
+        if parent_run_id is None:
+            if random.random() >= self.sample_rate:
+                return
+            self.sampled += 1
+            trace_id, parent_id = uuid.uuid4().hex, None
+        else:
+            parent = self._open.get(parent_run_id)
+            if parent is None:
+                return  # Part of a turn that was not sampled
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        self._open[run_id] = Span(trace_id, run_id.hex, parent_id, name,
+                                  kind, time.time(), attributes=attributes)
+
+    def _end(self, run_id, error: BaseException = None, **attributes):
+        span = self._open.pop(run_id, None)
+        if span is None:
+            return
+        span.end = time.time()
+        span.attributes.update(attributes)
+        if error is not None:
+            span.status = "error"
+            span.attributes["error"] = repr(error)
+        self.exporter.submit(span)
+
+    def on_chain_start(self, serialized, inputs, *, run_id,
+                       parent_run_id=None, tags=None, metadata=None,
+                       **kwargs):
+        metadata = metadata or {}
+        name = kwargs.get("name") or "chain"
+        attributes = {}
+        if metadata.get("thread_id"):
+            attributes["thread_id"] = metadata["thread_id"]
+        if metadata.get("langgraph_node"):
+            attributes["node"] = metadata["langgraph_node"]
+        self._start("graph" if parent_run_id is None else "chain", name,
+                    run_id, parent_run_id, attributes)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id,
+                            parent_run_id=None, metadata=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._start("llm", kwargs.get("name") or "chat_model", run_id,
+                    parent_run_id,
+                    {"model": params.get("model") or
+                     params.get("model_name") or params.get("_type"),
+                     "prompt_messages": len(messages[0]) if messages else 0})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = {}
+        try:
+            message = response.generations[0][0].message
+            usage = dict(message.usage_metadata or {})
+        except (AttributeError, IndexError):
+            pass
+        self._end(run_id, **usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id,
+                      parent_run_id=None, **kwargs):
+        self._start("tool", kwargs.get("name") or
+                    (serialized or {}).get("name", "tool"),
+                    run_id, parent_run_id, {})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def report(self) -> dict:
+        return {"sampled_turns": self.sampled, **self.exporter.report()}
+
+
+def handler_from_env() -> Optional[TraceHandler]:
+    """A TraceHandler if TRACING=sampled, configured by TRACE_SAMPLE_RATE
+    (default 0.1), TRACE_FILE (default traces.jsonl), TRACE_QUEUE_SIZE and
+    TRACE_BATCH_SIZE. Nothing starts until the first span is recorded."""
+    if os.getenv("TRACING", "mlflow").lower() != "sampled":
+        return None
+    exporter = BatchExporter(
+        JsonlFileExporter(os.getenv("TRACE_FILE", "traces.jsonl")),
+        max_queue=int(os.getenv("TRACE_QUEUE_SIZE", 1000)),
+        batch_size=int(os.getenv("TRACE_BATCH_SIZE", 100)))
+    return TraceHandler(exporter,
+                        float(os.getenv("TRACE_SAMPLE_RATE", 0.1)))